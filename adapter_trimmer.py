@@ -1,12 +1,20 @@
 import re
 import os
+import sys
+import argparse
 import PySimpleGUI as sg
 import threading
 import time
 import queue
+from collections import OrderedDict
+from quality_filter import PREVIEW_READS, STDIO_PATH, ShardWriter, is_stream, open_input, stream_batches, sample_reads, format_preview, shard_layout, sharding_from_values
 
 sg.theme('DarkTeal9')  # Change the theme here
 
+# Default limits of the trimming cache
+CACHE_ENTRIES = 100000
+CACHE_MB = 64
+
 # Layout
 
 def create_layout():
@@ -26,8 +34,16 @@ def create_layout():
             sg.Input(key='output_file', tooltip='Choose the output FASTQ file to save trimmed sequences'),
             sg.SaveAs(file_types=(('FASTQ Files', '*.fastq;*.fq'),))
         ],
+        shard_layout('shard_mode', 'shard_value'),
+        [
+            sg.Text('Cache entries:', size=(15, 1), tooltip='Number of distinct sequences whose trimming result is remembered, 0 disables the cache'),
+            sg.Input(key='cache_entries', default_text=str(CACHE_ENTRIES), size=(10, 1)),
+            sg.Text('Cache MB:', tooltip='Memory limit of the trimming cache'),
+            sg.Input(key='cache_mb', default_text=str(CACHE_MB), size=(6, 1))
+        ],
         [
             sg.Button('Start Trimming', tooltip='Trim adapters from sequences'),
+            sg.Button('Preview', tooltip='Trim adapters from a random sample of sequences'),
             sg.Button('Clear', tooltip='Clear input fields'),
             sg.Button('Help', tooltip='Show usage instructions'),
             sg.Button('Exit', tooltip='Exit the program')
@@ -67,48 +83,121 @@ def read_adapter_sequences(adapter_file):
 
     return adapter_list
 
+# Remove all adapter matches from a sequence
+
+def remove_adapters(sequence, patterns):
+    for pattern in patterns:
+        sequence = pattern.sub('', sequence)
+    return sequence
+
+# Remember the trimming result of recently seen sequences
+
+class TrimCache:
+    """
+    LRU cache of adapter trimming results keyed by read sequence.
+
+    When adapters are only removed from the end of a read, which is the usual case, just the trimmed length
+    is stored. The cache holds at most max_entries sequences and roughly max_mb of memory, and evicts the
+    least recently used sequence when either limit is exceeded.
+    """
+
+    def __init__(self, max_entries=CACHE_ENTRIES, max_mb=CACHE_MB):
+        self.max_entries = max_entries
+        self.max_bytes = max_mb * 1024 * 1024
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _entry_size(sequence, entry):
+        # Key, value and about 100 bytes for the dictionary entry and its linked list node
+        return sys.getsizeof(sequence) + sys.getsizeof(entry) + 100
+
+    def trim(self, sequence, patterns):
+        entry = self.entries.get(sequence)
+        if entry is not None:
+            self.entries.move_to_end(sequence)
+            self.hits += 1
+            return sequence[:entry] if isinstance(entry, int) else entry
+
+        self.misses += 1
+        trimmed = remove_adapters(sequence, patterns)
+        if self.max_entries > 0:
+            entry = len(trimmed) if sequence.startswith(trimmed) else trimmed
+            self.entries[sequence] = entry
+            self.size += self._entry_size(sequence, entry)
+            while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+                old_sequence, old_entry = self.entries.popitem(last=False)
+                self.size -= self._entry_size(old_sequence, old_entry)
+                self.evictions += 1
+        return trimmed
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def summary(self):
+        return f'Cache hit rate: {self.hit_rate() * 100:.2f}% ({self.hits} hits, {self.misses} misses, {self.evictions} evictions)'
+
+# Trim adapters from a random sample of sequences
+
+def preview_adapters(sequence_file, adapter_list, n=PREVIEW_READS):
+    records, estimated_total = sample_reads(sequence_file, n)
+    patterns = [re.compile(adapter) for adapter in adapter_list]
+    trimmed_count = sum(1 for heading, sequence, plus_line, quality_line in records if remove_adapters(sequence, patterns) != sequence)
+    counts = {'Trimmed': trimmed_count, 'Untouched': len(records) - trimmed_count}
+    return counts, len(records), estimated_total
+
 # Trim adapters from sequences
 
-def trim_adapters(queue, error_queue, adapter_list, sequence_file, output_file, progress_callback=None):
+def trim_adapters(queue, error_queue, adapter_list, sequence_file, output_file, progress_callback=None, sharding=None, cache_entries=CACHE_ENTRIES, cache_mb=CACHE_MB):
     try:
-        total_sequences = sum(1 for _ in open(sequence_file)) // 4
+        # A stream can only be read once, so its progress is not known
+        total_sequences = 0 if is_stream(sequence_file) else sum(1 for _ in open(sequence_file)) // 4
         processed_sequences = 0
         trimmed_sequences = 0
         start_time = time.time()
+        cache = TrimCache(cache_entries, cache_mb)
 
-        with open(sequence_file) as seq_file, open(output_file, 'w') as out_file:
+        with open_input(sequence_file) as seq_file, ShardWriter(output_file, **(sharding or {})) as out_file:
             patterns = [re.compile(adapter) for adapter in adapter_list]
-            for count, line in enumerate(seq_file, start=0):
-                if count % 4 == 0:
-                    heading = line.strip()
-                elif count % 4 == 1:
-                    sequence = line.strip()
-                elif count % 4 == 2:
-                    plus_line = line.strip()
-                elif count % 4 == 3:
-                    quality_line = line.strip()
-
+            for records in stream_batches(seq_file):
+                for heading, sequence, plus_line, quality_line in records:
                     original_sequence = sequence
-                    for pattern in patterns:
-                        sequence = pattern.sub('', sequence)
+                    sequence = cache.trim(sequence, patterns)
 
                     if original_sequence != sequence:
                         trimmed_sequences += 1
 
-                    out_file.write(f'{heading}\n{sequence}\n{plus_line}\n{quality_line}\n')
+                    out_file.write_record(f'{heading}\n{sequence}\n{plus_line}\n{quality_line}\n')
 
-                    if progress_callback and count % 4 == 3:
+                    if progress_callback:
                         processed_sequences += 1
-                        progress = (processed_sequences / total_sequences) * 100
+                        progress = (processed_sequences / total_sequences) * 100 if total_sequences else 0
                         progress_callback(progress)
 
         elapsed_time = time.time() - start_time
-        return trimmed_sequences, elapsed_time
+        return trimmed_sequences, elapsed_time, cache
     
     except Exception as e:
-        error_queue.put(str(e))
+        error_queue.put(e)
+
+
 
+def show_help():
+    help_text = """How to use Adapter Trimmer:
+1. Choose an adapter file (FASTQ or FASTA format) containing the adapter sequences to be trimmed.
+2. Choose a sequence file (FASTQ format) containing the sequences to be trimmed.
+3. Choose an output file (FASTQ format) where the trimmed sequences will be saved. Trimming results of repeated sequences are cached, "Cache entries" and "Cache MB" limit the size of the cache. Optionally split the output into shards by shard count, reads per shard or MB per shard. The shards and a manifest with their read counts are written next to the output file.
+4. Click "Start Trimming" to start the trimming process. A progress bar will indicate the progress of the operation.
+5. When trimming is complete, a confirmation message will be displayed.
 
+Click "Preview" to trim adapters from a random sample of sequences and see the projected fraction of trimmed sequences.
+
+Note: You can click "Clear" to reset the input fields and start over."""
+    sg.popup('Help', help_text)
 
 # Main function
 
@@ -148,34 +237,38 @@ def main():
 
             try:
                 adapter_list = read_adapter_sequences(adapter_file)
-                with open(output_file, 'w') as out_f:
-                    out_f.write('')
-                
-                total_sequences = sum(1 for _ in open(values['sequence_file'])) // 4
-                trimming_thread = threading.Thread(target=lambda q, eq, *args: q.put(trim_adapters(*args)), args=(result_queue, error_queue, adapter_list, sequence_file, output_file, update_progress_bar))
+                sharding = sharding_from_values(values['shard_mode'], values['shard_value'])
+                cache_entries = int(values['cache_entries'])
+                cache_mb = int(values['cache_mb'])
+                total_sequences = 0 if is_stream(sequence_file) else sum(1 for _ in open(sequence_file)) // 4
+                trimming_thread = threading.Thread(target=lambda q, eq, *args: q.put(trim_adapters(q, eq, *args)), args=(result_queue, error_queue, adapter_list, sequence_file, output_file, update_progress_bar, sharding, cache_entries, cache_mb))
                 trimming_thread.start()
             except Exception as e:
                 sg.popup(f'Error: {e}')
 
+        if event == 'Preview':
+            if not values['adapter_file'] or not values['sequence_file']:
+                sg.popup('Please choose an adapter file and a sequence file')
+                continue
+            try:
+                adapter_list = read_adapter_sequences(values['adapter_file'])
+                print(format_preview(*preview_adapters(values['sequence_file'], adapter_list)))
+            except Exception as e:
+                sg.popup(f'Error: {e}')
+
         if event == 'Clear':
             window['adapter_file']('')
             window['sequence_file']('')
             window['output_file']('')
 
         if event == 'Help':
-            help_text = """How to use Adapter Trimmer:
-1. Choose an adapter file (FASTQ or FASTA format) containing the adapter sequences to be trimmed.
-2. Choose a sequence file (FASTQ format) containing the sequences to be trimmed.
-3. Choose an output file (FASTQ format) where the trimmed sequences will be saved.
-4. Click "Start Trimming" to start the trimming process. A progress bar will indicate the progress of the operation.
-5. When trimming is complete, a confirmation message will be displayed.
-
-Note: You can click "Clear" to reset the input fields and start over."""
-            sg.popup('Help', help_text)
+            show_help()
 
         if trimming_thread and not trimming_thread.is_alive():
-            trimmed_sequences, elapsed_time = result_queue.get()
-            print(f'\nTrimming complete.\nTrimmed sequences: {trimmed_sequences}\nRuntime: {elapsed_time:.2f} seconds')
+            result = result_queue.get()
+            if result is not None:
+                trimmed_sequences, elapsed_time, cache = result
+                print(f'\nTrimming complete.\nTrimmed sequences: {trimmed_sequences}\nRuntime: {elapsed_time:.2f} seconds\n{cache.summary()}')
             trimming_thread = None
 
         if not error_queue.empty():
@@ -186,5 +279,30 @@ Note: You can click "Clear" to reset the input fields and start over."""
 
     window.close()
 
+def stream_main(args):
+    parser = argparse.ArgumentParser(description='Trim adapters from FASTQ, streaming from stdin to stdout by default.')
+    parser.add_argument('-a', '--adapters', required=True, help='FASTQ or FASTA file with adapter sequences')
+    parser.add_argument('-i', '--input', default=STDIO_PATH, help="FASTQ file or named pipe to read, '-' for stdin")
+    parser.add_argument('-o', '--output', default=STDIO_PATH, help="FASTQ file or named pipe to write, '-' for stdout")
+    parser.add_argument('--cache-entries', type=int, default=CACHE_ENTRIES, help='Number of distinct sequences whose trimming result is cached, 0 disables the cache')
+    parser.add_argument('--cache-mb', type=int, default=CACHE_MB, help='Memory limit of the trimming cache in MB')
+    args = parser.parse_args(args)
+
+    error_queue = queue.Queue()
+    result = trim_adapters(None, error_queue, read_adapter_sequences(args.adapters), args.input, args.output,
+                           cache_entries=args.cache_entries, cache_mb=args.cache_mb)
+    if not error_queue.empty():
+        error = error_queue.get()
+        if isinstance(error, BrokenPipeError):
+            # The reading end of the pipe was closed, e.g. by head
+            sys.stderr.close()
+            return
+        sys.exit(f'Trimming Error: {error}')
+    trimmed_sequences, elapsed_time, cache = result
+    print(f'Trimmed sequences: {trimmed_sequences}\nRuntime: {elapsed_time:.2f} seconds\n{cache.summary()}', file=sys.stderr)
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    if len(sys.argv) > 1:
+        stream_main(sys.argv[1:])
+    else:
+        main()
\ No newline at end of file
@@ -1,75 +1,384 @@
-import PySimpleGUI as sg
+import os
+import time
+import queue
 import importlib
+from concurrent.futures import ThreadPoolExecutor
+import PySimpleGUI as sg
 
 sg.theme('DarkTeal9')  # Change the theme here
 
-# Define the functions and layouts for each script
+# Maximum number of jobs that run at the same time, the rest wait in the queue
+MAX_WORKERS = max(1, min(4, os.cpu_count() or 1))
+
+# Job runners
+# Each runner receives the values of the tool window and does the work synchronously on a worker thread,
+# so it must not use the GUI. It raises on failure and returns (number of items processed, unit, summary text),
+# optionally followed by a function that is called with the tool window on the GUI thread once the job is done
+
+def run_adapter_trimmer_job(values):
+    adapter_trimmer = importlib.import_module('adapter_trimmer')
+    quality_filter = importlib.import_module('quality_filter')
+    for key, label in (('adapter_file', 'an adapter file'), ('sequence_file', 'a sequence file'), ('output_file', 'an output file')):
+        if not values[key]:
+            raise ValueError(f'Please choose {label}')
+
+    adapter_list = adapter_trimmer.read_adapter_sequences(values['adapter_file'])
+    error_queue = queue.Queue()
+    processed = [0]  # The progress callback is called once per read
+
+    def count_read(progress):
+        processed[0] += 1
+
+    sharding = quality_filter.sharding_from_values(values['shard_mode'], values['shard_value'])
+    result = adapter_trimmer.trim_adapters(None, error_queue, adapter_list, values['sequence_file'], values['output_file'], count_read, sharding,
+                                           int(values['cache_entries']), int(values['cache_mb']))
+    if not error_queue.empty():
+        raise ValueError(error_queue.get())
+
+    trimmed_sequences, elapsed_time, cache = result
+    total_sequences = processed[0]
+    return total_sequences, 'reads', f'Trimmed sequences: {trimmed_sequences}\nRuntime: {elapsed_time:.2f} seconds\n{cache.summary()}'
+
+def run_quality_filter_job(values):
+    quality_filter = importlib.import_module('quality_filter')
+    sequence_file = values['-SEQUENCE_FILE-']
+    output_file = values['-OUTPUT_FILE-']
+    if not sequence_file or not output_file or not values['-THRESHOLD-']:
+        raise ValueError('Please fill in the sequence file, threshold and output file')
+    if not os.access(sequence_file, os.R_OK):
+        raise ValueError(f'Sequence file {sequence_file} is not readable')
+
+    threshold = int(values['-THRESHOLD-'])
+    predicates = quality_filter.predicates_from_values(values)
+    sharding = quality_filter.sharding_from_values(values['-SHARD_MODE-'], values['-SHARD_VALUE-'])
+    result_queue = queue.Queue()
+    quality_filter.quality_filter(sequence_file, threshold, output_file, None, result_queue, predicates, sharding)
+    _, (threshold, total_count, filtered_count, discarded_count, discarded_percent, elapsed_time, output_file, discarded_counts) = result_queue.get()
+    discarded_by = ''.join(f'\n  Discarded by {name}: {count} reads' for name, count in discarded_counts.items())
+    return total_count, 'reads', f'Output: {filtered_count} reads\nDiscarded: {discarded_count} reads ({discarded_percent:.2f}%){discarded_by}\nFiltered file is saved as: {output_file}'
+
+def run_quality_trimmer_job(values):
+    quality_trimmer = importlib.import_module('quality_trimmer')
+    quality_filter = importlib.import_module('quality_filter')
+    if not values['-SEQUENCE_FILE-'] or not values['-OUTPUT_FILE-'] or not values['-THRESHOLD-']:
+        raise ValueError('Please fill in the sequence file, threshold and output file')
+
+    result_queue, error_queue = queue.Queue(), queue.Queue()
+    sharding = quality_filter.sharding_from_values(values['-SHARD_MODE-'], values['-SHARD_VALUE-'])
+    quality_trimmer.quality_trimmer(result_queue, error_queue, values['-SEQUENCE_FILE-'], int(values['-THRESHOLD-']), values['-OUTPUT_FILE-'], queue.Queue(), queue.Queue(), sharding)
+    if not error_queue.empty():
+        raise ValueError(error_queue.get())
+
+    threshold, total_count, trimmed_count, discarded_count, discarded_percent, elapsed_time, output_file = result_queue.get()
+    return total_count, 'reads', f'Trimmed sequences: {trimmed_count}\nRuntime: {elapsed_time:.2f} seconds\nTrimmed file is saved as: {output_file}'
+
+def run_deduplicator_job(values):
+    deduplicator = importlib.import_module('deduplicator')
+    if not values['-SEQUENCE_FILE-'] or not values['-OUTPUT_FILE-']:
+        raise ValueError('Please fill in the sequence file and output file')
+
+    memory_mb = int(values['-MEMORY_MB-'])
+    if memory_mb < 1:
+        raise ValueError('Memory budget must be a positive integer')
+
+    umi_separator = values['-UMI_SEPARATOR-'] if values['-USE_UMI-'] else None
+    result_queue = queue.Queue()
+    deduplicator.deduplicate(values['-SEQUENCE_FILE-'], values['-OUTPUT_FILE-'], memory_mb, umi_separator, result_queue)
+    msg_type, msg_data = result_queue.get()
+    if msg_type == 'Error':
+        raise ValueError(msg_data)
+
+    total_count, unique_count, duplicate_count, duplicate_percent, spilled_partitions, elapsed_time, output_file = msg_data
+    return total_count, 'reads', f'Output: {unique_count} reads\nDuplicates: {duplicate_count} reads ({duplicate_percent:.2f}%)\nDeduplicated file is saved as: {output_file}'
+
+def run_dea_job(values):
+    import pandas as pd
+    dea_analysis = importlib.import_module('dea_analysis')
+    count_data = pd.read_csv(values['counts_file'], index_col=0)
+    results_df, DEGs, results_file = dea_analysis.edger_DEA(count_data, values['clinical_file'], int(values['min_total_counts']), values['design_factors'].split(','), float(values['min_lfc']), float(values['max_pval']))
+    return (len(results_df), 'genes', f'Differential expression analysis complete.\nSignificant genes: {len(DEGs)}\nResults written to {results_file}',
+            dea_plots_window(results_df, dea_analysis.EDGER_COLUMNS, float(values['min_lfc']), float(values['max_pval']), 'edgeR Plots'))
+
+def run_pydeseq2_job(values):
+    import pandas as pd
+    pydeseq2_gui = importlib.import_module('pydeseq2_gui')
+    counts_df = pd.read_csv(values['counts_file'], index_col=0)
+    clinical_df = pd.read_csv(values['clinical_file'], index_col=0)
+    counts_df, clinical_df = pydeseq2_gui.filter_data(counts_df, clinical_df, int(values['min_total_counts']))
+    results_df = pydeseq2_gui.run_pydeseq2(counts_df, clinical_df, values['design_factors'].split(','), float(values['min_lfc']), float(values['max_pval']), verbose=False)
+    results_file = os.path.splitext(values['counts_file'])[0] + '_PyDESeq2_results.csv'
+    results_df.to_csv(results_file)
+    return (len(results_df), 'genes', f'PyDESeq2 analysis complete.\nResults written to {results_file}',
+            dea_plots_window(results_df, pydeseq2_gui.PYDESEQ2_COLUMNS, float(values['min_lfc']), float(values['max_pval']), 'PyDESeq2 Plots'))
+
+def run_quality_filter_sweep_job(values):
+    quality_filter = importlib.import_module('quality_filter')
+    sequence_file = values['-SEQUENCE_FILE-']
+    if not sequence_file or not os.access(sequence_file, os.R_OK):
+        raise ValueError('Please choose a readable sequence file')
+
+    result_queue = queue.Queue()
+    quality_filter.analyze_thresholds(sequence_file, result_queue)
+    msg_type, msg_data = result_queue.get()
+    if msg_type == 'Error':
+        raise ValueError(msg_data)
+
+    headings, rows = msg_data
+    return rows[0][1], 'reads', 'Threshold sweep complete.', threshold_sweep_window('Quality Threshold Sweep', headings, rows)
+
+def run_quality_trimmer_sweep_job(values):
+    quality_trimmer = importlib.import_module('quality_trimmer')
+    sequence_file = values['-SEQUENCE_FILE-']
+    if not sequence_file or not os.access(sequence_file, os.R_OK):
+        raise ValueError('Please choose a readable sequence file')
+
+    sweep_queue, error_queue = queue.Queue(), queue.Queue()
+    quality_trimmer.analyze_trim_thresholds(sequence_file, sweep_queue, error_queue)
+    if not error_queue.empty():
+        raise ValueError(error_queue.get())
+
+    headings, rows = sweep_queue.get()
+    return rows[0][1], 'reads', 'Trim threshold sweep complete.', threshold_sweep_window('Trim Threshold Sweep', headings, rows)
+
+def threshold_sweep_window(title, headings, rows):
+    # Show the sweep table on the GUI thread and write the selected threshold back to the tool window
+    def show(window):
+        quality_filter = importlib.import_module('quality_filter')
+        threshold = quality_filter.show_threshold_sweep(title, headings, rows)
+        if threshold is not None:
+            window['-THRESHOLD-'].update(str(threshold))
+    return show
+
+def run_pydeseq2_designs_job(values):
+    import pandas as pd
+    pydeseq2_gui = importlib.import_module('pydeseq2_gui')
+    counts_df = pd.read_csv(values['counts_file'], index_col=0)
+    clinical_df = pd.read_csv(values['clinical_file'], index_col=0)
+    counts_df, clinical_df = pydeseq2_gui.filter_data(counts_df, clinical_df, int(values['min_total_counts']))
+    designs = [values['design_factors'].split(',')]
+    designs += [line.split(',') for line in values['extra_designs'].splitlines() if line.strip()]
+    comparison_df, summary_df = pydeseq2_gui.run_pydeseq2_designs(counts_df, clinical_df, designs, float(values['min_lfc']), float(values['max_pval']),
+                                                                  int(values['resamples']), float(values['resample_fraction']), int(values['n_workers']))
+    comparison_file = os.path.splitext(values['counts_file'])[0] + '_design_comparison.csv'
+    comparison_df.to_csv(comparison_file)
+    return len(summary_df), 'runs', f'{summary_df.to_string(index=False)}\nDesign comparison written to {comparison_file}'
+
+def dea_plots_window(results_df, columns, min_lfc, max_pval, title):
+    # Show the volcano and MA plots of a finished DEA job on the GUI thread
+    def show(window):
+        dea_plots = importlib.import_module('dea_plots')
+        dea_plots.show_dea_plots(results_df, columns, min_lfc, max_pval, title=title)
+    return show
+
+# Event handlers
+# Quick actions of a tool window that run on the GUI thread, they return text for the job log
+
+def preview_adapter_trimmer(window, values):
+    adapter_trimmer = importlib.import_module('adapter_trimmer')
+    quality_filter = importlib.import_module('quality_filter')
+    if not values['adapter_file'] or not values['sequence_file']:
+        raise ValueError('Please choose an adapter file and a sequence file')
+    adapter_list = adapter_trimmer.read_adapter_sequences(values['adapter_file'])
+    return quality_filter.format_preview(*adapter_trimmer.preview_adapters(values['sequence_file'], adapter_list))
+
+def preview_quality_filter(window, values):
+    quality_filter = importlib.import_module('quality_filter')
+    if not values['-SEQUENCE_FILE-'] or not values['-THRESHOLD-']:
+        raise ValueError('Please choose a sequence file and enter a quality score threshold')
+    predicates = quality_filter.predicates_from_values(values)
+    return quality_filter.format_preview(*quality_filter.preview_filter(values['-SEQUENCE_FILE-'], predicates))
+
+def preview_quality_trimmer(window, values):
+    quality_trimmer = importlib.import_module('quality_trimmer')
+    quality_filter = importlib.import_module('quality_filter')
+    if not values['-SEQUENCE_FILE-'] or not values['-THRESHOLD-']:
+        raise ValueError('Please choose a sequence file and enter a quality score threshold')
+    return quality_filter.format_preview(*quality_trimmer.preview_trimmer(values['-SEQUENCE_FILE-'], int(values['-THRESHOLD-'])))
+
+# Define the job runners, event handlers and layouts for each script, 'jobs' lists further events that run as jobs
+# and 'uses_r' marks scripts that call into embedded R, which must never run on two threads at once
 scripts = {
-    'Adapter Trimmer': {'function': 'adapter_trimmer.main', 'layout_module': 'adapter_trimmer'},
-    'Quality Filter': {'function': 'quality_filter.main', 'layout_module': 'quality_filter'},
-    'Quality Trimmer': {'function': 'quality_trimmer.main', 'layout_module': 'quality_trimmer'},
-    'DEA - edgeR via Rpy2 implementation': {'function': 'dea_analysis.main', 'layout_module': 'dea_analysis'},
-    'DEA - PyDESeq2 Implementation': {'function': 'pydeseq2_gui.main', 'layout_module': 'pydeseq2_gui'}
+    'Adapter Trimmer': {'job': run_adapter_trimmer_job, 'start_event': 'Start Trimming', 'layout_module': 'adapter_trimmer',
+                        'handlers': {'Preview': preview_adapter_trimmer}},
+    'Quality Filter': {'job': run_quality_filter_job, 'start_event': 'Start Filtering', 'layout_module': 'quality_filter',
+                       'handlers': {'Preview': preview_quality_filter}, 'jobs': {'Analyze Thresholds': run_quality_filter_sweep_job}},
+    'Quality Trimmer': {'job': run_quality_trimmer_job, 'start_event': 'Start Trimming', 'layout_module': 'quality_trimmer',
+                        'handlers': {'Preview': preview_quality_trimmer}, 'jobs': {'Analyze Thresholds': run_quality_trimmer_sweep_job}},
+    'Deduplicator': {'job': run_deduplicator_job, 'start_event': 'Start Deduplication', 'layout_module': 'deduplicator'},
+    'DEA - edgeR via Rpy2 implementation': {'job': run_dea_job, 'start_event': 'Run DEA', 'layout_module': 'dea_analysis', 'uses_r': True},
+    'DEA - PyDESeq2 Implementation': {'job': run_pydeseq2_job, 'start_event': 'Run PyDESeq2', 'layout_module': 'pydeseq2_gui',
+                                      'jobs': {'Compare Designs': run_pydeseq2_designs_job}}
 }
 
+descriptions = {
+    'Adapter Trimmer': 'Opens the Adapter Trimmer application, which helps in removing adapter sequences from high-throughput sequencing data.',
+    'Quality Filter': 'Opens the Quality Filter application, which helps in filtering out low quality reads from your sequencing data to improve downstream analysis.',
+    'Quality Trimmer': 'Opens the Quality Trimmer application, which trims low quality bases from the ends of sequences. It helps in maintaining the high quality of the sequencing data.',
+    'Deduplicator': 'Opens the Deduplicator application, which removes exact duplicate reads, optionally taking the UMI into account, and reports the duplication rate.',
+    'DEA - edgeR via Rpy2 implementation': 'Opens the DEA - edgeR via Rpy2 implementation application. This is used to identify genes that are differentially expressed between different experimental conditions.',
+    'DEA - PyDESeq2 Implementation': 'Opens the DEA - PyDESeq2 Implementation application. This is another method used to identify differentially expressed genes.',
+}
+
+# Job manager
+
+class JobManager:
+    """Runs tool submissions as jobs in a bounded worker pool and keeps track of their status."""
+
+    headings = ['Job', 'Tool', 'Status', 'Elapsed', 'Throughput']
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.r_executor = ThreadPoolExecutor(max_workers=1)  # Runs the R jobs one after the other
+        self.status_queue = queue.Queue()
+        self.jobs = []
+
+    def submit(self, name, values, event=None, window=None):
+        # event selects one of the script's extra jobs, window is passed to the job's follow-up function
+        job_function = scripts[name]['jobs'][event] if event else scripts[name]['job']
+        job = {'id': len(self.jobs) + 1, 'tool': f'{name} - {event}' if event else name, 'status': 'Queued', 'submitted': time.time(),
+               'started': None, 'finished': None, 'processed': 0, 'unit': '', 'message': '', 'window': window, 'show': None}
+        self.jobs.append(job)
+        executor = self.r_executor if scripts[name].get('uses_r') else self.executor
+        executor.submit(self._run, job['id'], job_function, dict(values))
+        return job['id']
 
+    def _run(self, job_id, job_function, values):
+        # Runs in a worker thread, so only report progress through the status queue
+        self.status_queue.put(('Running', job_id, time.time()))
+        try:
+            processed, unit, message, *show = job_function(values)
+            self.status_queue.put(('Finished', job_id, (time.time(), processed, unit, message, show[0] if show else None)))
+        except Exception as e:
+            self.status_queue.put(('Failed', job_id, (time.time(), str(e))))
+
+    def poll(self):
+        # Apply status updates from the workers, returns the jobs that ended since the last poll
+        ended = []
+        while True:
+            try:
+                status, job_id, data = self.status_queue.get_nowait()
+            except queue.Empty:
+                break
+            job = self.jobs[job_id - 1]
+            job['status'] = status
+            if status == 'Running':
+                job['started'] = data
+            elif status == 'Finished':
+                job['finished'], job['processed'], job['unit'], job['message'], job['show'] = data
+                ended.append(job)
+            elif status == 'Failed':
+                job['finished'], job['message'] = data
+                ended.append(job)
+        return ended
+
+    def table_rows(self):
+        now = time.time()
+        rows = []
+        for job in self.jobs:
+            if job['started'] is None:
+                elapsed = 0.0
+            else:
+                elapsed = (job['finished'] or now) - job['started']
+            if job['status'] == 'Finished' and elapsed > 0:
+                throughput = f"{job['processed'] / elapsed:,.0f} {job['unit']}/s"
+            else:
+                throughput = ''
+            rows.append([job['id'], job['tool'], job['status'], f'{elapsed:.1f} s', throughput])
+        return rows
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.r_executor.shutdown(wait=False, cancel_futures=True)
 
 # Define a function to create a script window
 def create_script_window(name):
-    # Get the function and module corresponding to the button clicked
-    function_name = scripts[name]['function']
-    layout_module_name = scripts[name]['layout_module']
-    function_module = importlib.import_module(function_name.rsplit('.', 1)[0])
-    function = getattr(function_module, function_name.rsplit('.', 1)[1])
-
     # Get the layout of the selected script
-    layout_module = importlib.import_module(layout_module_name)
+    layout_module = importlib.import_module(scripts[name]['layout_module'])
     layout = layout_module.create_layout()  # Call the create_layout function
 
-    # Create the PySimpleGUI window for the script
-    window = sg.Window(name, layout)
-    window.finalize()
+    # Create the PySimpleGUI window for the script, it is not modal so several tools can be open at once
+    window = sg.Window(name, layout, finalize=True)
+    return window
+
+def create_main_layout():
+    layout = [
+        [sg.Button(name, size=(50, 2)), sg.Text(descriptions[name], size=(50, 2))] for name in scripts.keys()
+    ] + [
+        [sg.Text(f'Jobs (up to {MAX_WORKERS} run at the same time)')],
+        [sg.Table(values=[], headings=JobManager.headings, key='jobs_table', auto_size_columns=False,
+                  col_widths=[5, 35, 10, 10, 20], num_rows=8, justification='left')],
+        [sg.Multiline(key='job_log', size=(110, 10), disabled=True, autoscroll=True)],  # Job results, tool windows have their own output
+        [sg.Button('Exit')],
+        [sg.Text('Consolidated GUI', key='Application name', size=(None, 1), justification='left', font=("Alike", 11, "bold"))],  # Application name
+        [sg.Text('Thesis Project. Created by Mohit Panwar. Supervised by Julia Åkesson.', key='credits', size=(None, 1), justification='left', font=("Alike", 9))]  # Credits
+    ]
+    return layout
+
+def main():
+    # Create the PySimpleGUI window for the main window
+    main_window = sg.Window('Script Selector', create_main_layout(), finalize=True)
+    job_manager = JobManager()
+    script_windows = {}
 
-    # Event loop for the script window
+    def log(text):
+        main_window['job_log'].print(text)
+
+    # Event loop for the main window and all open script windows
     while True:
-        event, values = window.read()
-        if event == sg.WIN_CLOSED:
-            break
-        elif event is not None:
-            # Call the function corresponding to the button clicked
-            function()
-
-    # Close the script window
-    window.close()
-
-# Define the PySimpleGUI layout for the main window
-main_layout = [
-    [sg.Button(name, size=(50, 2)), sg.Text({
-                                                  'Adapter Trimmer': 'Opens the Adapter Trimmer application, which helps in removing adapter sequences from high-throughput sequencing data.',
-                                                  'Quality Filter': 'Opens the Quality Filter application, which helps in filtering out low quality reads from your sequencing data to improve downstream analysis.',
-                                                  'Quality Trimmer': 'Opens the Quality Trimmer application, which trims low quality bases from the ends of sequences. It helps in maintaining the high quality of the sequencing data.',
-                                                  'DEA - edgeR via Rpy2 implementation': 'Opens the DEA - edgeR via Rpy2 implementation application. This is used to identify genes that are differentially expressed between different experimental conditions.',
-                                                  'DEA - PyDESeq2 Implementation': 'Opens the DEA - PyDESeq2 Implementation application. This is another method used to identify differentially expressed genes.',
-                                              }[name], size=(50, 2))] for name in scripts.keys()
-] + [
-    [sg.Button('Exit')],
-    [sg.Text('Consolidated GUI', key='Application name', size=(None, 1), justification='left', font=("Alike", 11, "bold"))],  # Application name
-    [sg.Text('Thesis Project. Created by Mohit Panwar. Supervised by Julia Åkesson.', key='credits', size=(None, 1), justification='left', font=("Alike", 9))]  # Credits
-]
-
-
-
-# Create the PySimpleGUI window for the main window
-window = sg.Window('Script Selector', main_layout)
-
-# Event loop for the main window
-while True:
-    event, values = window.read()
-    if event == sg.WIN_CLOSED or event == 'Exit':
-        break
-    elif event is not None:
-        # Open the script window for the selected script
-        create_script_window(event)
-
-# Close the main window
-window.close()
+        window, event, values = sg.read_all_windows(timeout=500)
+
+        if window == main_window:
+            if event == sg.WIN_CLOSED or event == 'Exit':
+                break
+            elif event in scripts:
+                # Open the script window for the selected script
+                script_windows[create_script_window(event)] = event
+
+        elif window in script_windows:
+            name = script_windows[window]
+            if event == sg.WIN_CLOSED or event == 'Exit':
+                del script_windows[window]
+                window.close()
+            elif event == scripts[name]['start_event']:
+                job_id = job_manager.submit(name, values)
+                log(f'Job {job_id} ({name}) queued.')
+            elif event in scripts[name].get('jobs', {}):
+                job_id = job_manager.submit(name, values, event, window)
+                log(f'Job {job_id} ({name} - {event}) queued.')
+            elif event in scripts[name].get('handlers', {}):
+                try:
+                    text = scripts[name]['handlers'][event](window, values)
+                    if text:
+                        log(f'\n{name} - {event}\n{text}')
+                except Exception as e:
+                    sg.popup(f'Error: {e}')
+            elif event == 'Clear':
+                # Reset the inputs to their defaults, so settings like the memory budget or cache size stay valid
+                for element in window.key_dict.values():
+                    if isinstance(element, sg.Input):
+                        element.update(element.DefaultText)
+            elif event == 'Help':
+                layout_module = importlib.import_module(scripts[name]['layout_module'])
+                if hasattr(layout_module, 'show_help'):
+                    layout_module.show_help()
+                else:
+                    sg.popup(name, descriptions[name])
+
+        for job in job_manager.poll():
+            if job['status'] == 'Finished':
+                log(f"\nJob {job['id']} ({job['tool']}) complete.\n{job['message']}")
+                # Skip the follow-up if its tool window was closed while the job ran
+                if job['show'] and job['window'] in script_windows:
+                    job['show'](job['window'])
+            else:
+                log(f"\nJob {job['id']} ({job['tool']}) failed: {job['message']}")
+        main_window['jobs_table'].update(values=job_manager.table_rows())
+
+    # Close all windows
+    job_manager.shutdown()
+    for window in script_windows:
+        window.close()
+    main_window.close()
+
+if __name__ == '__main__':
+    main()
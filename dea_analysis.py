@@ -1,7 +1,9 @@
+import os
 import pandas as pd
 import rpy2.robjects as robjects
 from rpy2.robjects import pandas2ri
 import PySimpleGUI as sg
+from dea_plots import EDGER_COLUMNS, show_dea_plots, significant_genes
 
 sg.theme('DarkTeal9')  # Change the theme here
 
@@ -26,6 +28,49 @@ def create_layout():
     ]
     return layout
 
+def edger_DEA(count_matrix, clinical_file, min_total_counts, design_factors, min_lfc, max_pval):
+    """
+    Run differential expression analysis using the edgeR package and save the significant genes, without using the GUI.
+
+    Parameters are the same as for run_DEA. Errors are raised to the caller.
+
+    Returns:
+    pandas.DataFrame: The results for all genes.
+    pandas.DataFrame: The significant genes.
+    str: The file path the significant genes were written to.
+    """
+    # Convert the Pandas dataframe to an R matrix
+    count_matrix_r = pandas2ri.py2rpy(count_matrix)
+
+    # Load the clinical data
+    clinical_data = pd.read_csv(clinical_file)
+    clinical_data_r = pandas2ri.py2rpy(clinical_data)
+
+    # Create the DGEList object
+    dge = robjects.r['DGEList'](counts=count_matrix_r, genes=robjects.vectors.FactorVector(count_matrix.index))
+
+    # Filter out low count genes
+    keep = dge.sum(axis=1) >= min_total_counts
+    dge_filtered = dge.rx(keep, True)
+
+    # Define the experimental design
+    design = clinical_data_r[design_factors]
+    dge_design = robjects.r['estimateDisp'](dge_filtered, design)
+
+    # Fit the model and perform the differential expression analysis
+    fit = robjects.r['glmQLFit'](dge_design, design)
+    qlf = robjects.r['glmQLFTest'](fit)
+    res = robjects.r['as.data.frame'](robjects.r['topTags'](qlf, n=robjects.r('Inf')))
+
+    # Convert the R dataframe to a Pandas dataframe
+    results_df = pandas2ri.rpy2py(res)
+    DEGs = results_df.loc[significant_genes(results_df['logFC'], results_df['PValue'], min_lfc, max_pval), ]
+
+    # Save the results to a file
+    results_file = os.path.splitext(clinical_file)[0] + '_DEA_results.csv'
+    DEGs.to_csv(results_file)
+    return results_df, DEGs, results_file
+
 def run_DEA(count_matrix, clinical_file, min_total_counts, design_factors, min_lfc, max_pval):
     """
     Run differential expression analysis using the edgeR package on a count matrix.
@@ -35,44 +80,20 @@ def run_DEA(count_matrix, clinical_file, min_total_counts, design_factors, min_l
     clinical_file (str): The file path of the clinical data file.
     min_total_counts (int): The minimum total read counts.
     design_factors (list): A list of design factors.
-    min_lfc (float): The minimum log fold change.
+    min_lfc (float): The minimum absolute log fold change.
     max_pval (float): The maximum p-value.
+
+    Returns:
+    pandas.DataFrame: The results for all genes, or None if the analysis failed.
     """
     try:
-        # Convert the Pandas dataframe to an R matrix
-        count_matrix_r = pandas2ri.py2rpy(count_matrix)
-
-        # Load the clinical data
-        clinical_data = pd.read_csv(clinical_file)
-        clinical_data_r = pandas2ri.py2rpy(clinical_data)
-
-        # Create the DGEList object
-        dge = robjects.r['DGEList'](counts=count_matrix_r, genes=robjects.vectors.FactorVector(count_matrix.index))
-
-        # Filter out low count genes
-        keep = dge.sum(axis=1) >= min_total_counts
-        dge_filtered = dge.rx(keep, True)
-
-        # Define the experimental design
-        design = clinical_data_r[design_factors]
-        dge_design = robjects.r['estimateDisp'](dge_filtered, design)
-
-        # Fit the model and perform the differential expression analysis
-        fit = robjects.r['glmQLFit'](dge_design, design)
-        qlf = robjects.r['glmQLFTest'](fit)
-        res = robjects.r['summary'](qlf)
-
-        # Convert the R dataframe to a Pandas dataframe
-        DEGs = pandas2ri.rpy2py(res)
-        DEGs = DEGs.loc[(DEGs['logFC'] > min_lfc) & (DEGs['PValue'] < max_pval), ]
+        results_df, DEGs, results_file = edger_DEA(count_matrix, clinical_file, min_total_counts, design_factors, min_lfc, max_pval)
 
         # Output results to the window
         print(DEGs)
 
-        # Save the results to a file
-        DEGs.to_csv(clinical_file.replace('.csv', '_DEA_results.csv'))
-
-        sg.popup(f'Differential expression analysis complete. Results written to {clinical_file.replace(".csv", "_DEA_results.csv")}')
+        sg.popup(f'Differential expression analysis complete. Results written to {results_file}')
+        return results_df
 
     except Exception as e:
         sg.popup(f'Error: {e}')
@@ -89,7 +110,7 @@ def show_help():
     
     4. Enter design factors as comma-separated values in the "Design Factors" box. Design factors are the clinical variables you want to compare. For example, if you want to compare samples based on their condition and account for batch effects, input "condition,batch". You can use any clinical variables available in your clinical data file as design factors.
     
-    5. Enter the minimum log fold change value in the "Min. Log Fold Change" box. Genes with a log fold change below this threshold will not be considered significant.
+    5. Enter the minimum log fold change value in the "Min. Log Fold Change" box. Genes with an absolute log fold change below this threshold will not be considered significant, so both up- and down-regulated genes are reported.
     
     6. Enter the maximum p-value in the "Max. P-value" box. Genes with a p-value above this threshold will not be considered significant.
     
@@ -148,7 +169,10 @@ def main():
                 count_data = pd.read_csv(counts_file, index_col=0)
 
                 # Run differential expression analysis using the modified run_DEA function
-                run_DEA(count_data, clinical_file, min_total_counts, design_factors, min_lfc, max_pval)
+                results_df = run_DEA(count_data, clinical_file, min_total_counts, design_factors, min_lfc, max_pval)
+
+                if results_df is not None and sg.popup_yes_no('Show volcano and MA plots of the results?') == 'Yes':
+                    show_dea_plots(results_df, EDGER_COLUMNS, min_lfc, max_pval, title='edgeR Plots')
 
             except Exception as e:
                 sg.popup(f'Error: {e}')
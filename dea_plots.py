@@ -0,0 +1,128 @@
+import numpy as np
+import matplotlib
+matplotlib.use('TkAgg')
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+import PySimpleGUI as sg
+
+sg.theme('DarkTeal9')  # Change the theme here
+
+# Result columns used for the plots: log fold change, p-value for significance, mean expression for the MA plot
+# and whether the mean expression is already on a log scale
+PYDESEQ2_COLUMNS = {'lfc': 'log2FoldChange', 'pvalue': 'padj', 'mean': 'baseMean', 'log_mean': False}
+EDGER_COLUMNS = {'lfc': 'logFC', 'pvalue': 'PValue', 'mean': 'logCPM', 'log_mean': True}
+
+def significant_genes(lfc, pvalue, min_lfc, max_pval):
+    # The rule shared by the plots and the saved results: p-value below max_pval and an absolute log fold
+    # change of at least min_lfc, so up- and down-regulated genes are both counted
+    return (pvalue < max_pval) & (abs(lfc) >= min_lfc)
+
+# Number of density raster bins along the x and y axis
+RASTER_BINS = (300, 200)
+
+class DensityScatter:
+    """
+    Scatter plot that draws the highlighted points as markers and all other points as a density raster.
+
+    The raster bin of every point is computed once, so changing which points are highlighted only needs
+    a bincount over the other points and never redraws them one by one.
+    """
+
+    def __init__(self, ax, x, y, bins=RASTER_BINS, color='tab:red'):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.valid = np.isfinite(self.x) & np.isfinite(self.y)
+        self.bins = bins
+        x_min, x_max = self._limits(self.x[self.valid])
+        y_min, y_max = self._limits(self.y[self.valid])
+        x_bin = np.clip(((np.where(self.valid, self.x, x_min) - x_min) / (x_max - x_min) * bins[0]).astype(int), 0, bins[0] - 1)
+        y_bin = np.clip(((np.where(self.valid, self.y, y_min) - y_min) / (y_max - y_min) * bins[1]).astype(int), 0, bins[1] - 1)
+        self.bin_index = np.where(self.valid, y_bin * bins[0] + x_bin, 0)
+
+        self.image = ax.imshow(np.zeros((bins[1], bins[0])), origin='lower', extent=(x_min, x_max, y_min, y_max),
+                               aspect='auto', cmap='Greys', interpolation='nearest')
+        self.markers = ax.scatter([], [], s=6, c=color, linewidths=0)
+        ax.set_xlim(x_min, x_max)
+        ax.set_ylim(y_min, y_max)
+
+    @staticmethod
+    def _limits(values):
+        if len(values) == 0:
+            return 0.0, 1.0
+        low, high = float(values.min()), float(values.max())
+        if low == high:
+            return low - 0.5, high + 0.5
+        return low, high + (high - low) * 1e-6
+
+    def update(self, highlighted):
+        background = self.valid & ~highlighted
+        counts = np.bincount(self.bin_index[background], minlength=self.bins[0] * self.bins[1])
+        density = np.log1p(counts).reshape(self.bins[1], self.bins[0])
+        self.image.set_data(density)
+        self.image.set_clim(0, max(float(density.max()), 1.0))
+        shown = self.valid & highlighted
+        self.markers.set_offsets(np.column_stack((self.x[shown], self.y[shown])))
+
+class DEAPlots:
+    """Volcano and MA plot of a differential expression results table, redrawn when the thresholds change."""
+
+    def __init__(self, figure, results_df, columns):
+        self.lfc = results_df[columns['lfc']].to_numpy(dtype=float)
+        self.pvalue = results_df[columns['pvalue']].to_numpy(dtype=float)
+        mean = results_df[columns['mean']].to_numpy(dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_mean = mean if columns['log_mean'] else np.log10(mean)
+            neg_log_pvalue = -np.log10(np.clip(self.pvalue, 1e-300, None))
+
+        self.volcano_ax, self.ma_ax = figure.subplots(1, 2)
+        self.volcano = DensityScatter(self.volcano_ax, self.lfc, neg_log_pvalue)
+        self.ma = DensityScatter(self.ma_ax, log_mean, self.lfc)
+        self.volcano_ax.set(title='Volcano plot', xlabel='Log fold change', ylabel=f"-log10({columns['pvalue']})")
+        self.ma_ax.set(title='MA plot', xlabel='Mean expression' + ('' if columns['log_mean'] else ' (log10)'), ylabel='Log fold change')
+
+        self.pvalue_line = self.volcano_ax.axhline(0, color='tab:blue', linewidth=0.8, linestyle='--')
+        self.lfc_lines = [self.volcano_ax.axvline(0, color='tab:blue', linewidth=0.8, linestyle='--') for _ in range(2)]
+        self.lfc_lines += [self.ma_ax.axhline(0, color='tab:blue', linewidth=0.8, linestyle='--') for _ in range(2)]
+
+    def update(self, min_lfc, max_pval):
+        # Returns the number of significant genes
+        significant = significant_genes(self.lfc, self.pvalue, min_lfc, max_pval)
+        self.volcano.update(significant)
+        self.ma.update(significant)
+        self.pvalue_line.set_ydata([-np.log10(max_pval)] * 2)
+        for line, value in zip(self.lfc_lines, (-min_lfc, min_lfc)):
+            line.set_xdata([value] * 2)
+        for line, value in zip(self.lfc_lines[2:], (-min_lfc, min_lfc)):
+            line.set_ydata([value] * 2)
+        return int(significant.sum())
+
+def show_dea_plots(results_df, columns, min_lfc, max_pval, title='DEA Plots'):
+    layout = [
+        [sg.Canvas(key='canvas')],
+        [sg.Text('Min. Log Fold Change'), sg.Input(key='min_lfc', default_text=str(min_lfc), size=(10, 1)),
+         sg.Text('Max. P-value'), sg.Input(key='max_pval', default_text=str(max_pval), size=(10, 1)),
+         sg.Button('Update'), sg.Button('Close')],
+        [sg.Text('', key='significant_text', size=(60, 1))]
+    ]
+    window = sg.Window(title, layout, finalize=True)
+    figure = Figure(figsize=(11, 4.5))
+    plots = DEAPlots(figure, results_df, columns)
+    canvas = FigureCanvasTkAgg(figure, window['canvas'].TKCanvas)
+    canvas.get_tk_widget().pack(side='top', fill='both', expand=1)
+
+    def redraw(min_lfc, max_pval):
+        significant_count = plots.update(min_lfc, max_pval)
+        canvas.draw_idle()
+        window['significant_text'].update(f'{significant_count} of {len(results_df)} genes significant')
+
+    redraw(min_lfc, max_pval)
+    while True:
+        event, values = window.read()
+        if event == sg.WIN_CLOSED or event == 'Close':
+            break
+        if event == 'Update':
+            try:
+                redraw(float(values['min_lfc']), float(values['max_pval']))
+            except ValueError:
+                sg.popup('Error: Min. Log Fold Change and Max. P-value must be numbers.')
+    window.close()
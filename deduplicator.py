@@ -0,0 +1,224 @@
+import os
+import time
+import queue
+import hashlib
+import tempfile
+import threading
+from array import array
+import PySimpleGUI as sg
+
+sg.theme('DarkTeal9')  # Change the theme here
+
+# Number of partition files the remaining reads are split into when the memory budget is exceeded
+SPILL_PARTITIONS = 16
+# Partitions that still do not fit are split again, up to this many levels
+MAX_SPILL_DEPTH = 6
+# One hash salt per spill level, so every level distributes the reads differently
+HASH_SALTS = [level.to_bytes(16, 'little') for level in range(MAX_SPILL_DEPTH + 1)]
+
+def create_layout():
+    layout = [
+        [sg.Text('Sequence file:', size=(15, 1)), sg.Input(tooltip="Select a '.fastq' or '.fq' file", key='-SEQUENCE_FILE-'), sg.FileBrowse(file_types=(('FASTQ Files', '*.fastq;*.fq'),))],
+        [sg.Text('Memory budget (MB):', size=(20, 1)), sg.Input(tooltip="Memory used for the hash table before spilling to disk", key='-MEMORY_MB-', default_text='1024', size=(8, 1))],
+        [sg.Checkbox('Use UMI from identifier', key='-USE_UMI-', tooltip="Treat reads as duplicates only if sequence and UMI match"),
+         sg.Text('UMI separator:'), sg.Input(tooltip="The UMI is the last field of the identifier after this character", key='-UMI_SEPARATOR-', default_text=':', size=(3, 1))],
+        [sg.Text('Output file:', size=(15, 1)), sg.Input(tooltip="Specify the output file location", key='-OUTPUT_FILE-'), sg.FileSaveAs(file_types=(('FASTQ Files', '*.fastq;*.fq'),))],
+        [sg.Button('Start Deduplication'), sg.Button('Clear'), sg.Button('Help'), sg.Button('Exit')],
+        [sg.Output(size=(80, 20))],
+        [sg.Text('', key='result_text')],
+        [sg.Text('Deduplicator', key='Application name', size=(None, 1), justification='left', font=("Alike", 11, "bold"))],
+        [sg.Text('Thesis Project. Created by Mohit Panwar. Supervised by Julia Åkesson.', key='credits', size=(None, 1), justification='left', font=("Alike", 9))]
+    ]
+    return layout
+
+class HashTable:
+    """Set of 64-bit read hashes stored in a fixed-width array with open addressing.
+
+    Uses 8 bytes per slot and is kept at most half full, so memory stays within the budget
+    given to the constructor. A slot holding 0 is empty, which is why read_hash never returns 0.
+    """
+
+    def __init__(self, budget_bytes):
+        capacity = 1 << max(4, (budget_bytes // 8).bit_length() - 1)
+        self.slots = array('Q', [0]) * capacity  # Built in place, without a temporary bytes buffer of the same size
+        self.mask = capacity - 1
+        self.max_entries = capacity // 2
+        self.count = 0
+
+    def add(self, h):
+        # Returns True if the hash was not in the table yet
+        slots, mask = self.slots, self.mask
+        i = h & mask
+        while True:
+            slot = slots[i]
+            if slot == 0:
+                slots[i] = h
+                self.count += 1
+                return True
+            if slot == h:
+                return False
+            i = (i + 1) & mask
+
+    def __contains__(self, h):
+        slots, mask = self.slots, self.mask
+        i = h & mask
+        while True:
+            slot = slots[i]
+            if slot == 0:
+                return False
+            if slot == h:
+                return True
+            i = (i + 1) & mask
+
+    def is_full(self):
+        return self.count >= self.max_entries
+
+def read_key(identifier, sequence, umi_separator=None):
+    if umi_separator:
+        umi = identifier.split()[0].rsplit(umi_separator, 1)[-1]
+        return f'{umi} {sequence}'.encode()
+    return sequence.encode()
+
+def read_hash(key, level=0):
+    h = int.from_bytes(hashlib.blake2b(key, digest_size=8, salt=HASH_SALTS[level]).digest(), 'little')
+    return h or 1
+
+def read_fastq(f):
+    for line in f:
+        identifier = line.rstrip('\n')
+        sequence = next(f).rstrip('\n')
+        separator = next(f).rstrip('\n')
+        quality = next(f).rstrip('\n')
+        yield identifier, sequence, separator, quality
+
+def deduplicate_records(records, g, budget_bytes, umi_separator, stats, spill_dir=None, level=0):
+    """
+    Write the first copy of every read in records to g.
+
+    Reads are kept in memory as 64-bit hashes. Once the hash table is full, reads that are not
+    duplicates of a read already written are spilled to partition files by hash, and every
+    partition is then deduplicated on its own with a fresh table. Reads from spilled partitions
+    are written after the reads that fit in memory.
+    """
+    table = HashTable(budget_bytes)
+    partitions = None
+    for identifier, sequence, separator, quality in records:
+        if level == 0:
+            stats['total'] += 1
+        h = read_hash(read_key(identifier, sequence, umi_separator), level)
+        if partitions is None:
+            if table.add(h):
+                stats['unique'] += 1
+                g.write(f'{identifier}\n{sequence}\n{separator}\n{quality}\n')
+                if table.is_full():
+                    partitions = [tempfile.TemporaryFile('w+', dir=spill_dir) for _ in range(SPILL_PARTITIONS)]
+                    stats['spilled_partitions'] += SPILL_PARTITIONS
+        elif h not in table:
+            partitions[(h >> 32) % SPILL_PARTITIONS].write(f'{identifier}\n{sequence}\n{separator}\n{quality}\n')
+
+    if partitions is None:
+        return
+    if level >= MAX_SPILL_DEPTH:
+        raise ValueError('Memory budget is too small to deduplicate this file')
+
+    table = None  # Free the table before the partitions are processed
+    for partition in partitions:
+        partition.seek(0)
+        deduplicate_records(read_fastq(partition), g, budget_bytes, umi_separator, stats, spill_dir, level + 1)
+        partition.close()
+
+def deduplicate(sequence_file, output_file, memory_mb, umi_separator, progress_queue):
+    try:
+        stats = {'total': 0, 'unique': 0, 'spilled_partitions': 0}
+        start_time = time.time()
+        spill_dir = os.path.dirname(output_file) or None
+        with open(sequence_file, 'r') as f, open(output_file, 'w') as g:
+            deduplicate_records(read_fastq(f), g, memory_mb * 1024 * 1024, umi_separator, stats, spill_dir)
+
+        elapsed_time = time.time() - start_time
+        total_count = stats['total']
+        duplicate_count = total_count - stats['unique']
+        duplicate_percent = duplicate_count / total_count * 100 if total_count else 0.0
+        progress_queue.put_nowait(('Result', (total_count, stats['unique'], duplicate_count, duplicate_percent, stats['spilled_partitions'], elapsed_time, output_file)))
+    except Exception as e:
+        progress_queue.put_nowait(('Error', str(e)))
+
+def show_help():
+    sg.popup("This tool removes exact duplicate reads from a '.fastq' or '.fq' file, keeping the first copy of each read.\n\n1. Select a FASTQ file.\n2. Set the memory budget. Reads are spilled to temporary files next to the output file when it is exceeded.\n3. Optionally compare the UMI at the end of the read identifier as well as the sequence.\n4. Specify an output file.\n5. Click 'Start Deduplication' to start the process.\n\nThe duplication rate will be displayed in the output window after deduplication is complete.")
+
+def main():
+    window = sg.Window('Deduplicator', create_layout())
+    progress_queue = queue.Queue()
+    dedup_thread = None
+
+    while True:
+        event, values = window.read(timeout=100)
+
+        if event == sg.WINDOW_CLOSED or event == 'Exit':
+            break
+
+        if event == 'Start Deduplication':
+            sequence_file = values['-SEQUENCE_FILE-']
+            memory_mb = values['-MEMORY_MB-']
+            output_file = values['-OUTPUT_FILE-']
+            umi_separator = values['-UMI_SEPARATOR-'] if values['-USE_UMI-'] else None
+
+            if not sequence_file:
+                sg.popup('Please choose a sequence file')
+                continue
+
+            if not output_file:
+                sg.popup('Please choose an output file')
+                continue
+
+            if not os.path.exists(sequence_file):
+                sg.popup('Sequence file does not exist')
+                continue
+            if not os.access(sequence_file, os.R_OK):
+                sg.popup('Sequence file is not readable')
+                continue
+
+            if values['-USE_UMI-'] and not umi_separator:
+                sg.popup('Please enter a UMI separator')
+                continue
+
+            output_dir, output_name = os.path.split(output_file)
+            if output_dir and not os.path.exists(output_dir):
+                sg.popup('Output directory does not exist')
+                continue
+            if os.path.splitext(output_name)[1] not in ['.fastq', '.fq']:
+                output_file = output_file + '.fastq'
+
+            try:
+                memory_mb = int(memory_mb)
+                if memory_mb < 1:
+                    raise ValueError
+                dedup_thread = threading.Thread(target=deduplicate, args=(sequence_file, output_file, memory_mb, umi_separator, progress_queue), daemon=True)
+                dedup_thread.start()
+            except ValueError:
+                sg.popup('Error: Memory budget must be a positive integer.')
+            except Exception as e:
+                sg.popup(f'Error during deduplication start: {e}')
+
+        elif event == 'Clear':
+            window['-SEQUENCE_FILE-'].update('')
+            window['-OUTPUT_FILE-'].update('')
+            window['result_text'].update('')
+
+        elif event == 'Help':
+            show_help()
+
+        try:
+            msg_type, msg_data = progress_queue.get_nowait()
+            if msg_type == 'Result':
+                total_count, unique_count, duplicate_count, duplicate_percent, spilled_partitions, elapsed_time, output_file = msg_data
+                print(f'Deduplication completed in {elapsed_time:.2f} seconds.\nInput: {total_count} reads\nOutput: {unique_count} reads\nDuplicates: {duplicate_count} reads ({duplicate_percent:.2f}%)\nSpilled partitions: {spilled_partitions}\nDeduplicated file is saved as: {output_file}')
+            elif msg_type == 'Error':
+                print('Error during deduplication:', msg_data)
+        except queue.Empty:
+            pass
+
+    window.close()
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,11 @@
+import os
 import PySimpleGUI as sg
+import numpy as np
 import pandas as pd
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from dea_plots import PYDESEQ2_COLUMNS, show_dea_plots, significant_genes
 from pydeseq2.dds import DeseqDataSet
 from pydeseq2.ds import DeseqStats
 
@@ -13,7 +19,11 @@ def create_layout():
         [sg.Text("Design Factors (comma separated)"), sg.Input(key="design_factors", size=(30, 1))],
         [sg.Text("Min. Log Fold Change"), sg.Input(key="min_lfc", default_text="1", size=(10, 1))],
         [sg.Text("Max. P-value"), sg.Input(key="max_pval", default_text="0.05", size=(10, 1))],
-        [sg.Button("Run PyDESeq2"), sg.Button("Help"), sg.Button("Exit")],
+        [sg.Text("Extra Designs (one per line)"), sg.Multiline(key="extra_designs", size=(30, 3))],
+        [sg.Text("Resamples"), sg.Input(key="resamples", default_text="0", size=(5, 1)),
+         sg.Text("Sample Fraction"), sg.Input(key="resample_fraction", default_text="0.8", size=(5, 1)),
+         sg.Text("Workers"), sg.Input(key="n_workers", default_text="4", size=(5, 1))],
+        [sg.Button("Run PyDESeq2"), sg.Button("Compare Designs"), sg.Button("Help"), sg.Button("Exit")],
         [sg.Output(size=(80, 20))],
         [sg.Text('PyDeseq2_GUI', key='Application name', size=(None, 1), justification='left', font=("Alike", 11, "bold"))],
         [sg.Text('Thesis Project. Created by Mohit Panwar. Supervised by Julia Åkesson.', key='credits', size=(None, 1), justification='left', font=("Alike", 9))]
@@ -32,26 +42,129 @@ def filter_data(counts_df, clinical_df, min_total_counts):
 
     return counts_df, clinical_df
 
-def run_pydeseq2(counts_df, clinical_df, design_factors, min_lfc, max_pval):
+def run_pydeseq2(counts_df, clinical_df, design_factors, min_lfc, max_pval, n_cpus=8, verbose=True):
     # Create and run DESeq2
     dds = DeseqDataSet(
         counts=counts_df,
         clinical=clinical_df,
         design_factors=design_factors,
         refit_cooks=True,
-        n_cpus=8,
+        n_cpus=n_cpus,
     )
     dds.deseq2()
 
     # Create DeseqStats object for hypothesis testing
-    ds = DeseqStats(dds, alpha=max_pval, n_cpus=8)
+    ds = DeseqStats(dds, alpha=max_pval, n_cpus=n_cpus)
     
     # Run the Wald test and get the results
     ds.summary()
     results_df = ds.results_df
-    print(results_df)
+    if verbose:
+        print(results_df)
     return results_df
 
+# Count matrix shared by the worker processes of run_pydeseq2_designs, set by _attach_counts
+_shared_counts = None
+
+def _attach_counts(shm_name, shape, dtype, samples, genes, clinical_df):
+    # Runs once in every worker process: map the shared count matrix without copying it
+    global _shared_counts
+    shm = shared_memory.SharedMemory(name=shm_name)
+    counts = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    _shared_counts = (shm, counts, samples, genes, clinical_df)
+
+def _run_design(label, design_factors, sample_positions, min_lfc, max_pval):
+    _, counts, samples, genes, clinical_df = _shared_counts
+    if sample_positions is None:
+        counts_df = pd.DataFrame(counts, index=samples, columns=genes, copy=False)
+        run_clinical_df = clinical_df
+    else:
+        counts_df = pd.DataFrame(counts[sample_positions], index=samples[sample_positions], columns=genes, copy=False)
+        run_clinical_df = clinical_df.iloc[sample_positions]
+    results_df = run_pydeseq2(counts_df, run_clinical_df, design_factors, min_lfc, max_pval, n_cpus=1, verbose=False)
+    return results_df[['baseMean', 'log2FoldChange', 'pvalue', 'padj']]
+
+def run_pydeseq2_designs(counts_df, clinical_df, designs, min_lfc, max_pval, resamples=0, resample_fraction=0.8, n_workers=4, seed=0):
+    """
+    Run PyDESeq2 for several designs, and optionally on random subsets of the samples, in worker processes.
+
+    The workers are spawned rather than forked, since the caller may be a thread of a Tk process.
+    The count matrix is copied once into shared memory and every worker maps it instead of
+    receiving its own pickled copy. PyDESeq2 still builds a working copy of the counts for every
+    run, and a resample first copies its subset of the samples, so peak memory grows with the
+    number of workers, about one extra count matrix per worker.
+
+    A run that fails, e.g. because a resample drew the samples of only one condition, does not stop
+    the others. It is reported in the summary with its error and left out of the comparison.
+
+    Parameters:
+    counts_df (pandas.DataFrame): The filtered count data, with samples as rows and genes as columns.
+    clinical_df (pandas.DataFrame): The clinical data, with samples as rows.
+    designs (list): A list of design factor lists, e.g. [['condition'], ['condition', 'batch']].
+    min_lfc (float): The minimum absolute log fold change for a gene to be counted as significant.
+    max_pval (float): The maximum adjusted p-value for a gene to be counted as significant.
+    resamples (int): The number of random sample subsets to run for every design.
+    resample_fraction (float): The fraction of samples drawn without replacement for every subset, above 0 and at most 1.
+    n_workers (int): The number of worker processes.
+    seed (int): Seed for drawing the sample subsets.
+
+    Returns:
+    pandas.DataFrame: One row per gene, with a column group per run.
+    pandas.DataFrame: One row per run with its design, number of samples, number of significant genes and error.
+    """
+    if not 0 < resample_fraction <= 1:
+        raise ValueError('The sample fraction must be above 0 and at most 1')
+
+    rng = np.random.default_rng(seed)
+    n_samples = len(counts_df)
+    subset_size = min(n_samples, max(2, int(round(n_samples * resample_fraction))))
+    tasks = []
+    design_counts = {}
+    for design_factors in designs:
+        design_label = '+'.join(design_factors)
+        # A design entered more than once gets a numbered label, so its runs keep their own columns
+        design_counts[design_label] = design_counts.get(design_label, 0) + 1
+        if design_counts[design_label] > 1:
+            design_label = f'{design_label} ({design_counts[design_label]})'
+        tasks.append((design_label, design_factors, None))
+        for i in range(resamples):
+            sample_positions = np.sort(rng.choice(n_samples, size=subset_size, replace=False))
+            tasks.append((f'{design_label} #{i + 1}', design_factors, sample_positions))
+
+    counts = counts_df.to_numpy()
+    shm = shared_memory.SharedMemory(create=True, size=max(1, counts.nbytes))
+    try:
+        np.ndarray(counts.shape, dtype=counts.dtype, buffer=shm.buf)[:] = counts
+        initargs = (shm.name, counts.shape, counts.dtype, counts_df.index.to_numpy(), counts_df.columns, clinical_df)
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_attach_counts, initargs=initargs) as executor:
+            futures = [executor.submit(_run_design, label, design_factors, sample_positions, min_lfc, max_pval)
+                       for label, design_factors, sample_positions in tasks]
+            results = {}
+            errors = {}
+            for (label, _, _), future in zip(tasks, futures):
+                try:
+                    results[label] = future.result()
+                except Exception as e:
+                    errors[label] = str(e)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    summary_rows = []
+    for label, design_factors, sample_positions in tasks:
+        if label in results:
+            significant = significant_genes(results[label]['log2FoldChange'], results[label]['padj'], min_lfc, max_pval)
+            significant_count = int(significant.sum())
+        else:
+            significant_count = None
+        summary_rows.append({'run': label, 'design': ','.join(design_factors),
+                             'samples': n_samples if sample_positions is None else len(sample_positions),
+                             'significant_genes': significant_count, 'error': errors.get(label, '')})
+    comparison_df = pd.concat(results, axis=1) if results else pd.DataFrame(index=counts_df.columns)
+    summary_df = pd.DataFrame(summary_rows).astype({'significant_genes': 'Int64'})
+    return comparison_df, summary_df
+
 
 def show_help():
     help_text = """
@@ -69,7 +182,9 @@ def show_help():
     
     6. Enter the maximum p-value in the "Max. P-value" box. Genes with a p-value above this threshold will not be considered significant.
     
-    7. Click "Run PyDESeq2" to perform the differential expression analysis. The results will be displayed in a new window.
+    7. Click "Run PyDESeq2" to perform the differential expression analysis. The results will be displayed in a new window. Click "Volcano / MA Plot" there to plot the results. Significant genes are drawn as red markers and all other genes as a grey density. Change the thresholds under the plots and click "Update" to redraw them.
+
+    8. To compare several designs, enter additional design factors in the "Extra Designs" box, one comma-separated design per line. Set "Resamples" to run every design again on that many random subsets of the samples, each containing the "Sample Fraction" of the samples. Click "Compare Designs" to run all of them in parallel on "Workers" processes. Every worker holds its own copy of the count matrix while it runs, so lower "Workers" if memory runs short. A summary with the number of significant genes per run is displayed, runs that failed, e.g. a resample without samples of one condition, are listed with their error, and the log fold changes and adjusted p-values of all runs are written to a single comparison file next to the count matrix file.
 
     File formats:
 
@@ -129,12 +244,39 @@ def main():
                                                              display_row_numbers=False,
                                                              auto_size_columns=True,
                                                              num_rows=min(25, len(results_df)))],
-                                                  [sg.Button("Close")]])
+                                                  [sg.Button("Volcano / MA Plot"), sg.Button("Close")]])
             while True:
                 res_event, _ = results_window.read()
                 if res_event == sg.WIN_CLOSED or res_event == "Close":
                     results_window.close()
                     break
+                if res_event == "Volcano / MA Plot":
+                    show_dea_plots(results_df, PYDESEQ2_COLUMNS, min_lfc, max_pval, title="PyDESeq2 Plots")
+        elif event == "Compare Designs":
+            counts_file = values["counts_file"]
+            clinical_file = values["clinical_file"]
+            min_total_counts = int(values["min_total_counts"])
+            designs = [values["design_factors"].split(',')]
+            designs += [line.split(',') for line in values["extra_designs"].splitlines() if line.strip()]
+            min_lfc = float(values["min_lfc"])
+            max_pval = float(values["max_pval"])
+            resamples = int(values["resamples"])
+            resample_fraction = float(values["resample_fraction"])
+            n_workers = int(values["n_workers"])
+
+            # Read input files into pandas dataframes
+            counts_df = pd.read_csv(counts_file, index_col=0)
+            clinical_df = pd.read_csv(clinical_file, index_col=0)
+
+            # Filter the data and run all designs in parallel
+            counts_df, clinical_df = filter_data(counts_df, clinical_df, min_total_counts)
+            comparison_df, summary_df = run_pydeseq2_designs(counts_df, clinical_df, designs, min_lfc, max_pval,
+                                                             resamples, resample_fraction, n_workers)
+
+            comparison_file = os.path.splitext(counts_file)[0] + '_design_comparison.csv'
+            comparison_df.to_csv(comparison_file)
+            print(summary_df.to_string(index=False))
+            print(f'Design comparison written to {comparison_file}')
         elif event == "Help":
             show_help()
 
@@ -1,7 +1,14 @@
 import os
+import sys
+import math
+import stat
+import random
+import argparse
 import threading
+import contextlib
 import time
 import queue
+import numpy as np
 import PySimpleGUI as sg
 
 sg.theme('DarkTeal9')
@@ -10,8 +17,14 @@ def create_layout():
     layout = [
         [sg.Text('Sequence file:', size=(15, 1)), sg.Input(tooltip="Select a '.fastq' or '.fq' file", key='-SEQUENCE_FILE-'), sg.FileBrowse(file_types=(('FASTQ Files', '*.fastq;*.fq'),))],
         [sg.Text('Quality score threshold:', size=(20, 1)), sg.Input(tooltip="Enter the quality score threshold", key='-THRESHOLD-', size=(5,1))],
+        [sg.Text('Min. read length:', size=(20, 1)), sg.Input(tooltip="Optional: discard reads shorter than this", key='-MIN_LENGTH-', size=(5,1)),
+         sg.Text('Max. N fraction:', size=(15, 1)), sg.Input(tooltip="Optional: discard reads with a larger fraction of N bases, e.g. 0.1", key='-MAX_N_FRACTION-', size=(5,1))],
+        [sg.Text('Min. bases with quality:', size=(20, 1)), sg.Input(tooltip="Optional: quality score Q", key='-MIN_Q-', size=(5,1)),
+         sg.Text('Min. count:', size=(15, 1)), sg.Input(tooltip="Optional: discard reads with fewer bases at or above Q", key='-MIN_Q_COUNT-', size=(5,1))],
+        [sg.Text('Max. single-base fraction:', size=(20, 1)), sg.Input(tooltip="Optional: discard low-complexity reads where one base makes up a larger fraction, e.g. 0.9", key='-MAX_BASE_FRACTION-', size=(5,1))],
         [sg.Text('Output file:', size=(15, 1)), sg.Input(tooltip="Specify the output file location", key='-OUTPUT_FILE-'), sg.FileSaveAs(file_types=(('FASTQ Files', '*.fastq;*.fq'),))],
-        [sg.Button('Start Filtering'), sg.Button('Clear'), sg.Button('Help'), sg.Button('Exit')],
+        shard_layout('-SHARD_MODE-', '-SHARD_VALUE-'),
+        [sg.Button('Start Filtering'), sg.Button('Preview'), sg.Button('Analyze Thresholds'), sg.Button('Clear'), sg.Button('Help'), sg.Button('Exit')],
         [sg.Output(size=(80, 20))],
         [sg.Text('', key='result_text')],
         [sg.Text('Quality Filter', key='Application name', size=(None, 1), justification='left', font=("Alike", 11, "bold"))],
@@ -19,41 +32,436 @@ def create_layout():
     ]
     return layout
 
+# Ways to split the output into shards, see sharding_from_values
+SHARD_MODES = ['None', 'Shard count', 'Reads per shard', 'MB per shard']
+
+def shard_layout(mode_key, value_key):
+    return [sg.Text('Output shards:', size=(15, 1)), sg.Combo(SHARD_MODES, default_value='None', key=mode_key, readonly=True, tooltip="Split the output into several files for parallel alignment"),
+            sg.Input(key=value_key, size=(8, 1), tooltip="Number of shards, reads per shard or MB per shard")]
+
+def sharding_from_values(mode, value):
+    # Convert the shard inputs of a window into ShardWriter arguments
+    if mode == 'None' or not mode:
+        return {}
+    value = int(value)
+    if value < 1:
+        raise ValueError('The shard value must be a positive integer')
+    if mode == 'Shard count':
+        return {'shard_count': value}
+    if mode == 'Reads per shard':
+        return {'reads_per_shard': value}
+    return {'bytes_per_shard': value * 1024 * 1024}
+
+# Path that stands for stdin as input and stdout as output
+STDIO_PATH = '-'
+
+def is_stream(path):
+    # stdin/stdout or a named pipe, which can only be read once and has no size
+    return path == STDIO_PATH or (os.path.exists(path) and stat.S_ISFIFO(os.stat(path).st_mode))
+
+def open_input(path):
+    if path == STDIO_PATH:
+        return contextlib.nullcontext(sys.stdin)
+    return open(path, 'r')
+
+class ShardWriter:
+    """
+    Writes FASTQ records to output_file, or to several shard files next to it.
+
+    With shard_count the records are dealt out over that many shards in turn, so the shards differ by at most
+    one read and are all closed at the end. With reads_per_shard or bytes_per_shard the shards are filled one
+    after another and each shard is closed as soon as it is full. Every closed shard is added to a manifest
+    file listing the reads and bytes per shard, so downstream tools can start on it right away.
+    An output_file of '-' writes to stdout, which cannot be sharded.
+    """
+
+    def __init__(self, output_file, shard_count=None, reads_per_shard=None, bytes_per_shard=None):
+        self.output_file = output_file
+        self.shard_count = shard_count
+        self.reads_per_shard = reads_per_shard
+        self.bytes_per_shard = bytes_per_shard
+        self.sharded = bool(shard_count or reads_per_shard or bytes_per_shard)
+        self.base_name, self.extension = os.path.splitext(output_file)
+        self.manifest_file = self.base_name + '.manifest.tsv'
+        self.shards = []  # [path, file, reads, bytes] for every shard
+        self.closed_shards = 0
+        self.next_shard = 0
+        if not self.sharded:
+            self.shards.append([output_file, sys.stdout if output_file == STDIO_PATH else open(output_file, 'w'), 0, 0])
+            return
+        if output_file == STDIO_PATH:
+            raise ValueError('Output written to stdout cannot be sharded')
+        self.manifest = open(self.manifest_file, 'w')
+        self.manifest.write('shard\treads\tbytes\n')
+        for _ in range(shard_count or 1):
+            self._open_shard()
+
+    def _open_shard(self):
+        path = f'{self.base_name}.part{len(self.shards) + 1:03d}{self.extension}'
+        self.shards.append([path, open(path, 'w'), 0, 0])
+
+    def _close_shard(self, shard):
+        path, f, reads, size = shard
+        if f is sys.stdout:
+            f.flush()
+        else:
+            f.close()
+        if self.sharded:
+            self.manifest.write(f'{path}\t{reads}\t{size}\n')
+            self.manifest.flush()
+        self.closed_shards += 1
+
+    def write_record(self, record_text):
+        if self.shard_count:
+            shard = self.shards[self.next_shard]
+            self.next_shard = (self.next_shard + 1) % self.shard_count
+        else:
+            shard = self.shards[-1]
+            if self.sharded and shard[2] > 0 and ((self.reads_per_shard and shard[2] >= self.reads_per_shard) or
+                                                  (self.bytes_per_shard and shard[3] + len(record_text) > self.bytes_per_shard)):
+                self._close_shard(shard)
+                self._open_shard()
+                shard = self.shards[-1]
+        shard[1].write(record_text)
+        shard[2] += 1
+        shard[3] += len(record_text)
+
+    def close(self):
+        for shard in self.shards[self.closed_shards:]:
+            self._close_shard(shard)
+        if self.sharded:
+            self.manifest.close()
+
+    def description(self):
+        if not self.sharded:
+            return self.output_file
+        return f'{len(self.shards)} shards listed in {self.manifest_file}'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
 def count_sequences(sequence_file):
     with open(sequence_file) as f:
         return sum(1 for line in f if line.startswith('@'))  # Count the number of lines starting with '@'
 
-def quality_filter(sequence_file, threshold, output_file, total_sequences, progress_queue):
+# Number of reads that are read and filtered together
+BATCH_SIZE = 10000
+
+def read_batches(f, batch_size=BATCH_SIZE):
+    batch = []
+    for line in f:
+        batch.append((line.strip(), next(f).strip(), next(f).strip(), next(f).strip()))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# Number of batches buffered between the reading thread and the processing thread
+STREAM_BUFFER_BATCHES = 8
+
+def stream_batches(f, batch_size=BATCH_SIZE, max_batches=STREAM_BUFFER_BATCHES):
+    """
+    Read batches from f in a background thread, buffering at most max_batches of them.
+
+    When processing or writing is slower than the input, e.g. because stdout is piped into a slow aligner,
+    the buffer fills up and the reading thread blocks, so the process feeding the input has to wait as well.
+    """
+    batch_queue = queue.Queue(maxsize=max_batches)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                batch_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def reader():
+        try:
+            for batch in read_batches(f, batch_size):
+                if not put(('Batch', batch)):
+                    return
+            put(('Done', None))
+        except Exception as e:
+            put(('Error', e))
+
+    threading.Thread(target=reader, daemon=True).start()
+    try:
+        while True:
+            msg_type, msg_data = batch_queue.get()
+            if msg_type == 'Done':
+                return
+            if msg_type == 'Error':
+                raise msg_data
+            yield msg_data
+    finally:
+        stop.set()
+
+class RecordBatch:
+    """A batch of FASTQ records with the sequences and quality scores of all reads concatenated into numpy arrays."""
+
+    def __init__(self, records):
+        self.records = records
+        self.lengths = np.fromiter((len(record[1]) for record in records), dtype=np.int64, count=len(records))
+        self.offsets = np.concatenate(([0], np.cumsum(self.lengths)[:-1])).astype(np.int64)
+        self._bases = None
+        self._quality_scores = None
+        self._sum_buffer = None
+
+    @property
+    def bases(self):
+        # Upper case base codes, with a trailing sentinel so every offset is a valid index
+        if self._bases is None:
+            joined = ''.join(record[1] for record in self.records).encode('ascii') + b'\0'
+            self._bases = np.frombuffer(joined, dtype=np.uint8) & 0xDF
+        return self._bases
+
+    @property
+    def quality_scores(self):
+        if self._quality_scores is None:
+            joined = ''.join(record[3] for record in self.records).encode('ascii') + b'!'
+            self._quality_scores = np.frombuffer(joined, dtype=np.uint8).astype(np.int16) - 33
+        return self._quality_scores
+
+    def per_read_sum(self, values):
+        # Sum values over the bases of every read, reads without bases sum to zero
+        if not len(self.records):
+            return np.zeros(0, dtype=np.int64)
+        if self.lengths[0] > 0 and (self.lengths == self.lengths[0]).all():
+            # Reads of equal length, the usual case, are the rows of a 2D view and need no copy
+            return values[:-1].reshape(len(self.records), -1).sum(axis=1, dtype=np.int64)
+        # Every predicate sums over the same bases, so the int64 copy for reduceat reuses one buffer
+        if self._sum_buffer is None:
+            self._sum_buffer = np.empty(len(values), dtype=np.int64)
+        np.copyto(self._sum_buffer, values)
+        self._sum_buffer[-1] = 0  # The trailing sentinel belongs to no read, but reduceat adds it to the last one
+        return np.where(self.lengths > 0, np.add.reduceat(self._sum_buffer, self.offsets), 0)
+
+# Predicates return a mask of the reads to keep, the cost decides the order they are evaluated in
+
+def min_length_predicate(min_length):
+    return ('Min. length', 0, lambda batch: batch.lengths >= min_length)
+
+def mean_quality_predicate(threshold):
+    return ('Mean quality', 1, lambda batch: (batch.per_read_sum(batch.quality_scores) >= threshold * batch.lengths) & ((batch.lengths > 0) | (threshold <= 0)))
+
+def min_quality_bases_predicate(min_q, min_count):
+    return (f'Min. bases with Q>={min_q}', 2, lambda batch: batch.per_read_sum(batch.quality_scores >= min_q) >= min_count)
+
+def max_n_fraction_predicate(max_fraction):
+    return ('Max. N fraction', 2, lambda batch: batch.per_read_sum(batch.bases == ord('N')) <= max_fraction * batch.lengths)
+
+def low_complexity_predicate(max_fraction):
+    def keep(batch):
+        base_counts = np.stack([batch.per_read_sum(batch.bases == ord(base)) for base in 'ACGT'])
+        return base_counts.max(axis=0) <= max_fraction * batch.lengths
+    return ('Low complexity', 3, keep)
+
+def build_predicates(threshold, min_length=None, max_n_fraction=None, min_q=None, min_q_count=None, max_base_fraction=None):
+    predicates = [mean_quality_predicate(threshold)]
+    if min_length is not None:
+        predicates.append(min_length_predicate(min_length))
+    if min_q is not None and min_q_count is not None:
+        predicates.append(min_quality_bases_predicate(min_q, min_q_count))
+    if max_n_fraction is not None:
+        predicates.append(max_n_fraction_predicate(max_n_fraction))
+    if max_base_fraction is not None:
+        predicates.append(low_complexity_predicate(max_base_fraction))
+    return predicates
+
+def predicates_from_values(values):
+    # Build the predicates from the window values, optional filters that are left empty are not applied
+    optional_values = [values[key].strip() for key in ('-MIN_LENGTH-', '-MAX_N_FRACTION-', '-MIN_Q-', '-MIN_Q_COUNT-', '-MAX_BASE_FRACTION-')]
+    min_length, max_n_fraction, min_q, min_q_count, max_base_fraction = (
+        convert(value) if value else None for value, convert in zip(optional_values, (int, float, int, int, float)))
+    return build_predicates(int(values['-THRESHOLD-']), min_length, max_n_fraction, min_q, min_q_count, max_base_fraction)
+
+def apply_predicates(batch, predicates, discarded_counts):
+    """
+    Return the positions of the reads in batch that pass all predicates.
+
+    Predicates are evaluated from cheap to expensive on the whole batch, so the base and quality
+    arrays are built only once. A discarded read is counted for the first predicate it fails.
+    """
+    keep = np.ones(len(batch.records), dtype=bool)
+    for name, cost, predicate in sorted(predicates, key=lambda p: p[1]):
+        if not keep.any():
+            break
+        mask = predicate(batch)
+        discarded_counts[name] = discarded_counts.get(name, 0) + int(np.count_nonzero(keep & ~mask))
+        keep &= mask
+    return np.flatnonzero(keep)
+
+# Highest quality score threshold offered by the threshold sweep
+MAX_THRESHOLD = 41
+
+def threshold_sweep(sequence_file):
+    """
+    Read sequence_file once and count the reads and bases quality_filter keeps for every threshold from 0 to MAX_THRESHOLD.
+
+    A read is kept for threshold t if its mean quality is at least t, which for integer t is the same as
+    the floor of its mean quality being at least t, so a histogram of the floored means is enough.
+
+    Returns:
+    int: The total number of reads.
+    int: The total number of bases.
+    numpy.ndarray: The number of reads kept for every threshold.
+    numpy.ndarray: The number of bases kept for every threshold.
+    """
+    read_histogram = np.zeros(MAX_THRESHOLD + 2, dtype=np.int64)
+    base_histogram = np.zeros(MAX_THRESHOLD + 2, dtype=np.int64)
+    with open(sequence_file, 'r') as f:
+        for records in read_batches(f):
+            batch = RecordBatch(records)
+            mean_quality = batch.per_read_sum(batch.quality_scores) // np.maximum(batch.lengths, 1)
+            bins = np.clip(mean_quality, 0, MAX_THRESHOLD + 1)
+            read_histogram += np.bincount(bins, minlength=MAX_THRESHOLD + 2)
+            base_histogram += np.bincount(bins, weights=batch.lengths, minlength=MAX_THRESHOLD + 2).astype(np.int64)
+
+    reads_kept = np.cumsum(read_histogram[::-1])[::-1][:MAX_THRESHOLD + 1]
+    bases_kept = np.cumsum(base_histogram[::-1])[::-1][:MAX_THRESHOLD + 1]
+    return int(read_histogram.sum()), int(base_histogram.sum()), reads_kept, bases_kept
+
+def analyze_thresholds(sequence_file, progress_queue):
+    try:
+        total_reads, total_bases, reads_kept, bases_kept = threshold_sweep(sequence_file)
+        rows = [[threshold, int(reads), f'{reads / max(total_reads, 1) * 100:.2f}', int(bases), f'{bases / max(total_bases, 1) * 100:.2f}']
+                for threshold, (reads, bases) in enumerate(zip(reads_kept, bases_kept))]
+        progress_queue.put_nowait(('Sweep', (['Threshold', 'Reads kept', 'Reads %', 'Bases kept', 'Bases %'], rows)))
+    except Exception as e:
+        progress_queue.put_nowait(('Error', str(e)))
+
+def show_threshold_sweep(title, headings, rows):
+    # Show the threshold sweep table and return the threshold of the selected row, or None
+    layout = [
+        [sg.Table(values=rows, headings=headings, key='sweep_table', auto_size_columns=True, justification='right',
+                  num_rows=min(25, len(rows)), select_mode=sg.TABLE_SELECT_MODE_BROWSE)],
+        [sg.Button('Use Threshold'), sg.Button('Close')]
+    ]
+    sweep_window = sg.Window(title, layout, modal=True)
+    threshold = None
+    while True:
+        sweep_event, sweep_values = sweep_window.read()
+        if sweep_event == sg.WIN_CLOSED or sweep_event == 'Close':
+            break
+        if sweep_event == 'Use Threshold' and sweep_values['sweep_table']:
+            threshold = rows[sweep_values['sweep_table'][0]][0]
+            break
+    sweep_window.close()
+    return threshold
+
+# Number of reads sampled for a preview
+PREVIEW_READS = 10000
+
+def sample_reads(sequence_file, n=PREVIEW_READS, seed=None):
+    """
+    Draw a random sample of about n reads from sequence_file without reading the whole file.
+
+    Small files are sampled with a reservoir over all reads. For larger files the reader seeks to n random
+    byte offsets and takes the first complete record after each of them, so every read is about equally
+    likely to be drawn when the reads have similar lengths.
+
+    Returns:
+    list: The sampled records as (identifier, sequence, separator, quality) tuples.
+    int: The estimated number of reads in the file.
+    """
+    rng = random.Random(seed)
+    file_size = os.path.getsize(sequence_file)
+    if file_size <= n * 1000:
+        reservoir = []
+        total_count = 0
+        with open(sequence_file, 'r') as f:
+            for records in read_batches(f):
+                for record in records:
+                    total_count += 1
+                    if len(reservoir) < n:
+                        reservoir.append(record)
+                    else:
+                        i = rng.randrange(total_count)
+                        if i < n:
+                            reservoir[i] = record
+        return reservoir, total_count
+
+    sampled = {}
+    with open(sequence_file, 'rb') as f:
+        for offset in sorted(rng.randrange(file_size) for _ in range(n)):
+            # Skip the partial line, then move forward one line at a time until a record starts
+            f.seek(offset)
+            f.readline()
+            start = f.tell()
+            lines = [f.readline() for _ in range(4)]
+            while lines[3]:
+                if lines[0].startswith(b'@') and lines[2].startswith(b'+'):
+                    break
+                start += len(lines[0])
+                lines = lines[1:] + [f.readline()]
+            else:
+                continue
+            if start not in sampled:
+                sampled[start] = (tuple(line.decode().strip() for line in lines), sum(len(line) for line in lines))
+
+    records = [record for record, size in sampled.values()]
+    mean_record_size = sum(size for record, size in sampled.values()) / max(len(sampled), 1)
+    return records, int(file_size / mean_record_size) if sampled else 0
+
+def proportion_interval(count, n, z=1.96):
+    # Wilson score interval for the proportion count / n, 95% by default
+    if n == 0:
+        return 0.0, 0.0, 0.0
+    p = count / n
+    denominator = 1 + z * z / n
+    centre = (p + z * z / (2 * n)) / denominator
+    half_width = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return p, max(0.0, centre - half_width), min(1.0, centre + half_width)
+
+def format_preview(counts, n, estimated_total):
+    lines = [f'Preview on {n} sampled reads (about {estimated_total} reads in the file):']
+    for name, count in counts.items():
+        p, low, high = proportion_interval(count, n)
+        lines.append(f'{name}: {p * 100:.2f}% (95% CI {low * 100:.2f}-{high * 100:.2f}%), projected {int(p * estimated_total)} reads')
+    return '\n'.join(lines)
+
+def preview_filter(sequence_file, predicates, n=PREVIEW_READS):
+    records, estimated_total = sample_reads(sequence_file, n)
+    discarded_counts = {name: 0 for name, cost, predicate in predicates}
+    keep = apply_predicates(RecordBatch(records), predicates, discarded_counts) if records else []
+    counts = {'Kept': len(keep), 'Discarded': len(records) - len(keep)}
+    counts.update((f'Discarded by {name}', count) for name, count in discarded_counts.items())
+    return counts, len(records), estimated_total
+
+def quality_filter(sequence_file, threshold, output_file, total_sequences, progress_queue, predicates=None, sharding=None):
+    if predicates is None:
+        predicates = build_predicates(threshold)
+    discarded_counts = {name: 0 for name, cost, predicate in predicates}
     filtered_count = 0
     total_count = 0
     start_time = time.time()
-    with open(sequence_file, 'r') as f, open(output_file, 'w') as g:
-        for line in f:
-            identifier = line.strip()
-            sequence = next(f).strip()
-            separator = next(f).strip()
-            quality_scores = [ord(c) - 33 for c in next(f).strip()]
-
-            # We count a sequence every time we encounter an identifier line (which starts with '@')
-            if identifier.startswith('@'):
-                total_count += 1
-
-            if sum(quality_scores)/len(quality_scores) < threshold:
-                continue
-
-            filtered_count += 1
-            g.write(identifier + '\n')
-            g.write(sequence + '\n')
-            g.write(separator + '\n')
-            g.write(''.join([chr(q + 33) for q in quality_scores]) + '\n')
+    with open_input(sequence_file) as f, ShardWriter(output_file, **(sharding or {})) as g:
+        for records in stream_batches(f):
+            total_count += len(records)
+            batch = RecordBatch(records)
+            keep = apply_predicates(batch, predicates, discarded_counts)
+            filtered_count += len(keep)
+            for i in keep:
+                g.write_record('\n'.join(records[i]) + '\n')
+        output_file = g.description()
 
     elapsed_time = time.time() - start_time
     discarded_count = total_count - filtered_count
-    discarded_percent = discarded_count / total_count * 100
-    progress_queue.put_nowait(('Result', (threshold, total_count, filtered_count, discarded_count, discarded_percent, elapsed_time, output_file)))
+    discarded_percent = discarded_count / total_count * 100 if total_count else 0.0
+    progress_queue.put_nowait(('Result', (threshold, total_count, filtered_count, discarded_count, discarded_percent, elapsed_time, output_file, discarded_counts)))
+
 
 
 
+def show_help():
+    sg.popup("This tool filters low-quality reads from a '.fastq' or '.fq' file based on the provided quality score threshold.\n\n1. Select a FASTQ file.\n2. Set a quality score threshold.\n   Optionally set a minimum read length, a maximum fraction of N bases, a minimum number of bases at or above a quality score, or a maximum fraction of a single base to remove low-complexity reads. All filters are applied in a single pass.\n3. Specify an output file.\n   Optionally split the output into shards by shard count, reads per shard or MB per shard. The shards and a manifest with their read counts are written next to the output file.\n4. Click 'Start Filtering' to start the process.\n\nClick 'Preview' to run the filter on a random sample of reads and see the projected fractions of kept and discarded reads.\n\nClick 'Analyze Thresholds' to read the file once and see how many reads and bases every threshold from 0 to 41 would keep. Select a row and click 'Use Threshold' to fill in the quality score threshold.\n\nResults will be displayed in the output window after filtering is complete.")
 
 def main():
     window = sg.Window('Quality Filter', create_layout())
@@ -101,34 +509,65 @@ def main():
                     continue
                 if os.path.isdir(output_file):
                     output_file = os.path.join(output_file, 'quality_filtered_' + base_file_name)
-                elif os.path.splitext(output_name)[1] not in ['.fastq', '.fq']:
+                elif os.path.splitext(output_name)[1] not in ['.fastq', '.fq'] and not is_stream(output_file):
                     output_file = output_file + '.fastq'
 
             try:
                 threshold = int(threshold)
-                total_count = count_sequences(sequence_file)
-                filtering_thread = threading.Thread(target=quality_filter, args=(sequence_file, threshold, output_file, total_count, progress_queue), daemon=True)
+                predicates = predicates_from_values(values)
+                sharding = sharding_from_values(values['-SHARD_MODE-'], values['-SHARD_VALUE-'])
+                total_count = None if is_stream(sequence_file) else count_sequences(sequence_file)
+                filtering_thread = threading.Thread(target=quality_filter, args=(sequence_file, threshold, output_file, total_count, progress_queue, predicates, sharding), daemon=True)
                 filtering_thread.start()
             except ValueError:
-                sg.popup('Error: Threshold must be an integer.')
+                sg.popup('Error: Threshold, length, counts and shard value must be integers and fractions must be numbers.')
             except Exception as e:
                 sg.popup(f'Error during filtering start: {e}')
 
+        elif event == 'Preview':
+            sequence_file = values['-SEQUENCE_FILE-']
+            if not sequence_file or not os.access(sequence_file, os.R_OK):
+                sg.popup('Please choose a readable sequence file')
+                continue
+            try:
+                print(format_preview(*preview_filter(sequence_file, predicates_from_values(values))))
+            except ValueError:
+                sg.popup('Error: Threshold, length and counts must be integers and fractions must be numbers.')
+            except Exception as e:
+                sg.popup(f'Error during preview: {e}')
+
+        elif event == 'Analyze Thresholds':
+            sequence_file = values['-SEQUENCE_FILE-']
+            if not sequence_file or not os.access(sequence_file, os.R_OK):
+                sg.popup('Please choose a readable sequence file')
+                continue
+            print('Analyzing quality score thresholds...')
+            threading.Thread(target=analyze_thresholds, args=(sequence_file, progress_queue), daemon=True).start()
+
         elif event == 'Clear':
             window['-SEQUENCE_FILE-'].update('')
             window['-THRESHOLD-'].update('')
             window['-OUTPUT_FILE-'].update('')
+            for key in ('-MIN_LENGTH-', '-MAX_N_FRACTION-', '-MIN_Q-', '-MIN_Q_COUNT-', '-MAX_BASE_FRACTION-'):
+                window[key].update('')
             window['Output'].update('')
             window['result_text'].update('')
 
         elif event == 'Help':
-            sg.popup("This tool filters low-quality reads from a '.fastq' or '.fq' file based on the provided quality score threshold.\n\n1. Select a FASTQ file.\n2. Set a quality score threshold.\n3. Specify an output file.\n4. Click 'Start Filtering' to start the process.\n\nResults will be displayed in the output window after filtering is complete.")
+            show_help()
 
         try:
             msg_type, msg_data = progress_queue.get_nowait()
             if msg_type == 'Result':
-                threshold, total_count, filtered_count, discarded_count, discarded_percent, elapsed_time, output_file = msg_data
+                threshold, total_count, filtered_count, discarded_count, discarded_percent, elapsed_time, output_file, discarded_counts = msg_data
                 print(f'Filtering completed in {elapsed_time:.2f} seconds.\nQuality cut-off: {threshold}\nInput: {total_count} reads\nOutput: {filtered_count} reads\nDiscarded: {discarded_count} reads ({discarded_percent:.2f}%)\nFiltered file is saved as: {output_file}')
+                for name, count in discarded_counts.items():
+                    print(f'  Discarded by {name}: {count} reads')
+            elif msg_type == 'Sweep':
+                headings, rows = msg_data
+                threshold = show_threshold_sweep('Quality Threshold Sweep', headings, rows)
+                if threshold is not None:
+                    window['-THRESHOLD-'].update(str(threshold))
             elif msg_type == 'Error':
                 print('Error during quality filtering:', msg_data)
         except queue.Empty:
@@ -136,5 +575,31 @@ def main():
 
     window.close()
 
+def stream_main(args):
+    parser = argparse.ArgumentParser(description='Filter low-quality reads from FASTQ, streaming from stdin to stdout by default.')
+    parser.add_argument('-i', '--input', default=STDIO_PATH, help="FASTQ file or named pipe to read, '-' for stdin")
+    parser.add_argument('-o', '--output', default=STDIO_PATH, help="FASTQ file or named pipe to write, '-' for stdout")
+    parser.add_argument('-t', '--threshold', type=int, required=True, help='Quality score threshold')
+    parser.add_argument('--min-length', type=int, help='Discard reads shorter than this')
+    parser.add_argument('--max-n-fraction', type=float, help='Discard reads with a larger fraction of N bases')
+    parser.add_argument('--min-q', type=int, help='Quality score for --min-q-count')
+    parser.add_argument('--min-q-count', type=int, help='Discard reads with fewer bases at or above --min-q')
+    parser.add_argument('--max-base-fraction', type=float, help='Discard reads where one base makes up a larger fraction')
+    args = parser.parse_args(args)
+
+    predicates = build_predicates(args.threshold, args.min_length, args.max_n_fraction, args.min_q, args.min_q_count, args.max_base_fraction)
+    progress_queue = queue.Queue()
+    try:
+        quality_filter(args.input, args.threshold, args.output, None, progress_queue, predicates)
+    except BrokenPipeError:
+        # The reading end of the pipe was closed, e.g. by head
+        sys.stderr.close()
+        return
+    threshold, total_count, filtered_count, discarded_count, discarded_percent, elapsed_time, output_file, discarded_counts = progress_queue.get()[1]
+    print(f'Input: {total_count} reads\nOutput: {filtered_count} reads\nDiscarded: {discarded_count} reads ({discarded_percent:.2f}%)', file=sys.stderr)
+
 if __name__ == '__main__':
-    main()
+    if len(sys.argv) > 1:
+        stream_main(sys.argv[1:])
+    else:
+        main()
@@ -1,9 +1,12 @@
 import os
 import sys
+import argparse
 import PySimpleGUI as sg
 import threading
 import time
 import queue
+import numpy as np
+from quality_filter import MAX_THRESHOLD, PREVIEW_READS, STDIO_PATH, RecordBatch, ShardWriter, is_stream, open_input, read_batches, stream_batches, sample_reads, format_preview, shard_layout, sharding_from_values, show_threshold_sweep
 
 sg.theme('DarkTeal9')  # Change the theme here
 
@@ -12,7 +15,8 @@ def create_layout():
         [sg.Text('Sequence file:', size=(15, 1)), sg.Input(key='-SEQUENCE_FILE-'), sg.FileBrowse(file_types=(('FASTQ Files', '*.fastq;*.fq'),))],
         [sg.Text('Quality score threshold:', size=(15, 1)), sg.Input(key='-THRESHOLD-', size=(5,1))],
         [sg.Text('Output file:', size=(15, 1)), sg.Input(key='-OUTPUT_FILE-'), sg.FileSaveAs(file_types=(('FASTQ Files', '*.fastq;*.fq'),))],
-        [sg.Button('Start Trimming'), sg.Button('Clear'), sg.Button('Help'), sg.Button('Exit')],
+        shard_layout('-SHARD_MODE-', '-SHARD_VALUE-'),
+        [sg.Button('Start Trimming'), sg.Button('Preview'), sg.Button('Analyze Thresholds'), sg.Button('Clear'), sg.Button('Help'), sg.Button('Exit')],
         [sg.ProgressBar(100, orientation='h', size=(40, 20), key='progress_bar')],
         [sg.Text('', key='progress_text', size=(30, 1))],
         [sg.Output(size=(80, 20))],
@@ -23,17 +27,100 @@ def create_layout():
     return layout
 
 
-def quality_trimmer(result_queue, error_queue, sequence_file, threshold, output_file, total_count_queue, progress_queue):
+def find_trim_point(quality_scores, threshold):
+    # Index of the last base with a quality of at least threshold, reads without such a base are not trimmed
+    trim_point = len(quality_scores)
+    for i in reversed(range(len(quality_scores))):
+        if quality_scores[i] >= threshold:
+            trim_point = i
+            break
+    return trim_point
+
+def preview_trimmer(sequence_file, threshold, n=PREVIEW_READS):
+    records, estimated_total = sample_reads(sequence_file, n)
+    counts = {'Kept untrimmed': 0, 'Trimmed': 0, 'Discarded': 0}
+    for identifier, sequence, separator, quality in records:
+        trimmed_length = len(sequence[:find_trim_point([ord(c) - 33 for c in quality], threshold) + 1])
+        if trimmed_length == 0:
+            counts['Discarded'] += 1
+        elif trimmed_length < len(sequence):
+            counts['Trimmed'] += 1
+        else:
+            counts['Kept untrimmed'] += 1
+    return counts, len(records), estimated_total
+
+def trim_threshold_sweep(sequence_file):
+    """
+    Read sequence_file once and count the reads and bases quality_trimmer keeps for every threshold from 0 to MAX_THRESHOLD.
+
+    A read is cut after its last base with a quality of at least the threshold, so the trimmed length is the
+    number of positions whose suffix maximum quality reaches the threshold. Reads without any such base are
+    kept untrimmed, like quality_trimmer does.
+
+    Returns:
+    int: The total number of reads.
+    int: The total number of bases.
+    numpy.ndarray: The number of reads kept for every threshold.
+    numpy.ndarray: The number of reads shortened for every threshold.
+    numpy.ndarray: The number of bases kept for every threshold.
+    """
+    suffix_histogram = np.zeros(MAX_THRESHOLD + 2, dtype=np.int64)
+    untrimmed_histogram = np.zeros(MAX_THRESHOLD + 2, dtype=np.int64)
+    trimmed_changes = np.zeros(MAX_THRESHOLD + 3, dtype=np.int64)
+    total_reads = 0
+    total_bases = 0
+    with open(sequence_file, 'r') as f:
+        for records in read_batches(f):
+            batch = RecordBatch(records)
+            lengths = batch.lengths[batch.lengths > 0]
+            n = len(batch.records)
+            total_reads += len(lengths)
+            total_bases += int(lengths.sum())
+            if len(lengths) == 0:
+                continue
+
+            # Suffix maximum of the quality scores within every read: offset every read so that a maximum
+            # never carries over from the read after it, and accumulate over the reversed batch
+            scores = batch.quality_scores[:-1].astype(np.int64)
+            read_offset = 128 * (n - 1 - np.repeat(np.arange(n), batch.lengths))
+            suffix_max = np.maximum.accumulate((scores + read_offset)[::-1])[::-1] - read_offset
+            suffix_histogram += np.bincount(np.clip(suffix_max, 0, MAX_THRESHOLD + 1), minlength=MAX_THRESHOLD + 2)
+
+            starts = batch.offsets[batch.lengths > 0]
+            max_quality = np.clip(suffix_max[starts], 0, MAX_THRESHOLD + 1)
+            last_quality = np.clip(scores[starts + lengths - 1], 0, MAX_THRESHOLD + 1)
+            untrimmed_histogram += np.bincount(max_quality, weights=lengths, minlength=MAX_THRESHOLD + 2).astype(np.int64)
+
+            # A read is shortened for last_quality < threshold <= max_quality
+            trimmed_changes += np.bincount(last_quality + 1, minlength=MAX_THRESHOLD + 3)
+            trimmed_changes -= np.bincount(max_quality + 1, minlength=MAX_THRESHOLD + 3)
+
+    reads_kept = np.full(MAX_THRESHOLD + 1, total_reads, dtype=np.int64)
+    reads_trimmed = np.cumsum(trimmed_changes)[:MAX_THRESHOLD + 1]
+    untrimmed_bases = np.concatenate(([0], np.cumsum(untrimmed_histogram)))[:MAX_THRESHOLD + 1]
+    bases_kept = np.cumsum(suffix_histogram[::-1])[::-1][:MAX_THRESHOLD + 1] + untrimmed_bases
+    return total_reads, total_bases, reads_kept, reads_trimmed, bases_kept
+
+def analyze_trim_thresholds(sequence_file, sweep_queue, error_queue):
     try:
-        if not os.path.exists(sequence_file):
+        total_reads, total_bases, reads_kept, reads_trimmed, bases_kept = trim_threshold_sweep(sequence_file)
+        rows = [[threshold, int(reads), int(trimmed), int(bases), f'{bases / max(total_bases, 1) * 100:.2f}']
+                for threshold, (reads, trimmed, bases) in enumerate(zip(reads_kept, reads_trimmed, bases_kept))]
+        sweep_queue.put((['Threshold', 'Reads kept', 'Reads trimmed', 'Bases kept', 'Bases %'], rows))
+    except Exception as e:
+        error_queue.put(str(e))
+
+def quality_trimmer(result_queue, error_queue, sequence_file, threshold, output_file, total_count_queue, progress_queue, sharding=None):
+    try:
+        if sequence_file != STDIO_PATH and not os.path.exists(sequence_file):
             raise ValueError(f'Sequence file {sequence_file} does not exist')
-        if not os.access(sequence_file, os.R_OK):
+        if sequence_file != STDIO_PATH and not os.access(sequence_file, os.R_OK):
             raise ValueError(f'Sequence file {sequence_file} is not readable')
 
         base_file_name = os.path.splitext(os.path.basename(sequence_file))[0]
         if output_file is None:
             output_file = 'quality_trimmed_' + base_file_name
-        else:
+        elif not is_stream(output_file):
             output_dir, output_name = os.path.split(output_file)
             if not os.path.exists(output_dir):
                 raise ValueError(f'Output directory {output_dir} does not exist')
@@ -47,43 +134,47 @@ def quality_trimmer(result_queue, error_queue, sequence_file, threshold, output_
         processed_count = 0
         start_time = time.time()
 
-        with open(sequence_file, 'r') as f, open(output_file, 'w') as g:
-            for line in f:
-                total_count += 1
-                if total_count % 4 == 1:
-                    identifier = line.strip()
-                elif total_count % 4 == 2:
-                    sequence = line.strip()
-                elif total_count % 4 == 3:
-                    separator = line.strip()
-                else:
-                    quality_scores = [ord(c) - 33 for c in line.strip()]
-                    trim_point = len(quality_scores)
-                    for i in reversed(range(len(quality_scores))):
-                        if quality_scores[i] >= threshold:
-                            trim_point = i
-                            break
+        with open_input(sequence_file) as f, ShardWriter(output_file, **(sharding or {})) as g:
+            for records in stream_batches(f):
+                for identifier, sequence, separator, quality in records:
+                    total_count += 1
+                    quality_scores = [ord(c) - 33 for c in quality]
+                    trim_point = find_trim_point(quality_scores, threshold)
                     trimmed_sequence = sequence[:trim_point+1]
                     trimmed_quality_scores = quality_scores[:trim_point+1]
                     if len(trimmed_sequence) > 0:
                         trimmed_count += 1
-                        g.write(identifier + '\n')
-                        g.write(trimmed_sequence + '\n')
-                        g.write(separator + '\n')
-                        g.write(''.join([chr(q + 33) for q in trimmed_quality_scores]) + '\n')
+                        trimmed_quality = ''.join([chr(q + 33) for q in trimmed_quality_scores])
+                        g.write_record(f'{identifier}\n{trimmed_sequence}\n{separator}\n{trimmed_quality}\n')
                     processed_count += 1
-                    progress = processed_count / (total_count // 4) * 100
-                    progress_queue.put(progress)
+                progress = processed_count / total_count * 100
+                progress_queue.put(progress)
+
+            output_file = g.description()
 
-        total_count //= 4
         total_count_queue.put(total_count)
 
         discarded_count = total_count - trimmed_count
-        discarded_percent = discarded_count / total_count * 100
+        discarded_percent = discarded_count / total_count * 100 if total_count else 0.0
         elapsed_time = time.time() - start_time
         result_queue.put((threshold, total_count, trimmed_count, discarded_count, discarded_percent, elapsed_time, output_file))
     except Exception as e:
-        error_queue.put(str(e))
+        error_queue.put(e)
+
+def show_help():
+    help_text = """How to use Quality Trimmer:
+1. Choose a sequence file (FASTQ format) containing the sequences to be trimmed.
+2. Enter the quality score threshold for trimming.
+3. Choose an output file (FASTQ format) where the trimmed sequences will be saved. Optionally split the output into shards by shard count, reads per shard or MB per shard. The shards and a manifest with their read counts are written next to the output file.
+4. Click "Start Trimming" to start the trimming process. A progress bar will indicate the progress of the operation.
+5. When trimming is complete, a confirmation message will be displayed.
+
+Click "Preview" to run the trimmer on a random sample of reads and see the projected fractions of trimmed and discarded reads.
+
+Click "Analyze Thresholds" to read the file once and see how many reads are shortened and how many bases are kept for every threshold from 0 to 41. Select a row and click "Use Threshold" to fill in the quality score threshold.
+
+Note: You can click "Clear" to reset the input fields and start over."""
+    sg.popup('Help', help_text)
 
 def main():
     window = sg.Window('Quality Trimmer', create_layout())
@@ -93,6 +184,7 @@ def main():
     trimming_thread = None
     result_queue = queue.Queue()
     error_queue = queue.Queue()
+    sweep_queue = queue.Queue()
 
     def update_progress_bar(progress):
         window['progress_bar'].update(progress)
@@ -123,17 +215,39 @@ def main():
 
             try:
                 threshold = int(threshold)
-                with open(output_file, 'w') as out_f:
-                    out_f.write('')
-                
-                trimming_thread = threading.Thread(target=quality_trimmer, args=(result_queue, error_queue, sequence_file, threshold, output_file, total_count_queue, progress_queue))
+                sharding = sharding_from_values(values['-SHARD_MODE-'], values['-SHARD_VALUE-'])
+                trimming_thread = threading.Thread(target=quality_trimmer, args=(result_queue, error_queue, sequence_file, threshold, output_file, total_count_queue, progress_queue, sharding))
                 trimming_thread.start()
             except Exception as e:
                 sg.popup(f'Error: {e}')
 
+        if event == 'Preview':
+            sequence_file = values['-SEQUENCE_FILE-']
+            if not sequence_file or not values['-THRESHOLD-']:
+                sg.popup('Please choose a sequence file and enter a quality score threshold')
+                continue
+            try:
+                print(format_preview(*preview_trimmer(sequence_file, int(values['-THRESHOLD-']))))
+            except Exception as e:
+                sg.popup(f'Error: {e}')
+
+        if event == 'Analyze Thresholds':
+            sequence_file = values['-SEQUENCE_FILE-']
+            if not sequence_file:
+                sg.popup('Please choose a sequence file')
+                continue
+            print('Analyzing quality score thresholds...')
+            threading.Thread(target=analyze_trim_thresholds, args=(sequence_file, sweep_queue, error_queue), daemon=True).start()
+
+        if not sweep_queue.empty():
+            headings, rows = sweep_queue.get()
+            threshold = show_threshold_sweep('Trimming Threshold Sweep', headings, rows)
+            if threshold is not None:
+                window['-THRESHOLD-'].update(str(threshold))
+
         if trimming_thread and not trimming_thread.is_alive():
             result = result_queue.get()
-            print(f'Trimming complete.\nTrimmed sequences: {result[2]}\nRuntime: {result[5]:.2f} seconds')
+            print(f'Trimming complete.\nTrimmed sequences: {result[2]}\nRuntime: {result[5]:.2f} seconds\nTrimmed file is saved as: {result[6]}')
             trimming_thread = None
 
         if event == 'Clear':
@@ -142,15 +256,7 @@ def main():
             window['-OUTPUT_FILE-'].update('')
 
         if event == 'Help':
-            help_text = """How to use Quality Trimmer:
-1. Choose a sequence file (FASTQ format) containing the sequences to be trimmed.
-2. Enter the quality score threshold for trimming.
-3. Choose an output file (FASTQ format) where the trimmed sequences will be saved.
-4. Click "Start Trimming" to start the trimming process. A progress bar will indicate the progress of the operation.
-5. When trimming is complete, a confirmation message will be displayed.
-
-Note: You can click "Clear" to reset the input fields and start over."""
-            sg.popup('Help', help_text)
+            show_help()
 
         if not total_count_queue.empty():
             total_count = total_count_queue.get()
@@ -167,5 +273,28 @@ Note: You can click "Clear" to reset the input fields and start over."""
 
     window.close()
 
+def stream_main(args):
+    parser = argparse.ArgumentParser(description='Trim low-quality bases from FASTQ, streaming from stdin to stdout by default.')
+    parser.add_argument('-i', '--input', default=STDIO_PATH, help="FASTQ file or named pipe to read, '-' for stdin")
+    parser.add_argument('-o', '--output', default=STDIO_PATH, help="FASTQ file or named pipe to write, '-' for stdout")
+    parser.add_argument('-t', '--threshold', type=int, required=True, help='Quality score threshold')
+    args = parser.parse_args(args)
+
+    result_queue = queue.Queue()
+    error_queue = queue.Queue()
+    quality_trimmer(result_queue, error_queue, args.input, args.threshold, args.output, queue.Queue(), queue.Queue())
+    if not error_queue.empty():
+        error = error_queue.get()
+        if isinstance(error, BrokenPipeError):
+            # The reading end of the pipe was closed, e.g. by head
+            sys.stderr.close()
+            return
+        sys.exit(f'Trimming Error: {error}')
+    threshold, total_count, trimmed_count, discarded_count, discarded_percent, elapsed_time, output_file = result_queue.get()
+    print(f'Input: {total_count} reads\nOutput: {trimmed_count} reads\nRuntime: {elapsed_time:.2f} seconds', file=sys.stderr)
+
 if __name__ == '__main__':
-    main()
+    if len(sys.argv) > 1:
+        stream_main(sys.argv[1:])
+    else:
+        main()